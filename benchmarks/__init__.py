@@ -0,0 +1,3 @@
+"""
+Benchmarks for fogl, runnable headless; see __main__.py.
+"""
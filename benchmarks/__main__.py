@@ -0,0 +1,51 @@
+"""
+Run the benchmarks, without a window.
+
+    $ python -m benchmarks --software --output results.json
+    $ python -m benchmarks --software --baseline results.json --threshold 0.2
+
+Exits with status 1 if anything got slower than the baseline by more than the threshold.
+"""
+
+import argparse
+import sys
+
+# Must come first, see fogl.headless.
+from fogl.headless import create_context
+
+from .runner import BENCHMARKS, compare, load, run, save
+from . import cases  # noqa: F401 (registers the benchmarks)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("names", nargs="*", help="Benchmarks to run (default: all)")
+    parser.add_argument("--software", action="store_true", help="Use Mesa's llvmpipe renderer")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--round-time", type=float, default=0.1, help="Seconds per round")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with results saved earlier")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown counted as a regression, as a fraction (default: 0.2)")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        sys.exit()
+
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    context = create_context(software=args.software)
+    results = run(args.names, args.rounds, args.round_time)
+    if args.output:
+        save(results, args.output)
+    if args.baseline:
+        print(f"\nCompared to {args.baseline}:")
+        regressions = compare(results, load(args.baseline), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
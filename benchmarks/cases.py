@@ -0,0 +1,185 @@
+"""
+The benchmarks. Each one sets up what it needs and returns the function to time.
+"""
+
+import io
+import math
+from pathlib import Path
+
+import imgui
+import numpy as np
+from euclid3 import Matrix4
+from pyglet import gl
+
+from fogl.buffer import Buffer, IndexBuffer
+from fogl.framebuffer import FrameBuffer
+from fogl.glutil import gl_matrix
+from fogl.imgui_pyglet import ProgrammablePipelineRenderer, PersistentPipelineRenderer
+from fogl.mesh import ObjMesh
+from fogl.obj import parse_obj_file
+from fogl.shader import Program, VertexShader, FragmentShader
+from fogl.texture import ImageTexture, NormalTexture, Texture
+from fogl.util import enabled, load_png
+from fogl.vao import VertexArrayObject
+from fogl.vertex import ObjVertices
+
+from .runner import benchmark
+
+
+EXAMPLES = Path(__file__).parent.parent / "examples"
+SUZANNE = EXAMPLES / "obj/suzanne.obj"
+PLASMA = EXAMPLES / "textures/plasma.png"
+
+
+def grid_obj(n: int) -> str:
+    "OBJ text for a grid of n x n quads, with texture coordinates and normals."
+    lines = [f"v {x / n} {y / n} 0" for y in range(n + 1) for x in range(n + 1)]
+    lines += [f"vt {x / n} {y / n}" for y in range(n + 1) for x in range(n + 1)]
+    lines.append("vn 0 0 1")
+    for y in range(n):
+        for x in range(n):
+            a = y * (n + 1) + x + 1
+            b, c, d = a + 1, a + n + 2, a + n + 1
+            lines.append(f"f {a}/{a}/1 {b}/{b}/1 {c}/{c}/1")
+            lines.append(f"f {a}/{a}/1 {c}/{c}/1 {d}/{d}/1")
+    return "\n".join(lines)
+
+
+def _framebuffer(size=(256, 256)):
+    return FrameBuffer(size, dict(color=Texture(size, unit=0), normal=NormalTexture(size, unit=1),
+                                  position=NormalTexture(size, unit=2)),
+                       autoclear=True, set_viewport=True)
+
+
+@benchmark("obj_parse_small")
+def obj_parse_small():
+
+    def parse():
+        with open(SUZANNE) as f:  # Has a material file, which is looked up next to it
+            parse_obj_file(f)
+
+    return parse
+
+
+@benchmark("obj_parse_large")
+def obj_parse_large():
+    text = grid_obj(150)  # 45000 triangles
+    return lambda: parse_obj_file(io.StringIO(text))
+
+
+@benchmark("buffer_from_list")
+def buffer_from_list():
+    data = [float(i) for i in range(100_000)]
+    return lambda: Buffer(data).delete()
+
+
+@benchmark("buffer_from_array")
+def buffer_from_array():
+    data = np.arange(100_000, dtype=np.float32)
+    return lambda: Buffer(data).delete()
+
+
+@benchmark("index_buffer_from_list")
+def index_buffer_from_list():
+    data = list(range(100_000))
+    return lambda: IndexBuffer(data).delete()
+
+
+@benchmark("index_buffer_from_array")
+def index_buffer_from_array():
+    data = np.arange(100_000, dtype=np.uint32)
+    return lambda: IndexBuffer(data).delete()
+
+
+@benchmark("png_load")
+def png_load():
+    return lambda: bytes(load_png(PLASMA)[1])  # The pixels are read lazily
+
+
+@benchmark("image_texture_upload")
+def image_texture_upload():
+    size, image = load_png(PLASMA)
+    image = bytes(image)
+    return lambda: ImageTexture(size, image).delete()
+
+
+@benchmark("vertices_setup")
+def vertices_setup():
+    with open(SUZANNE) as f:
+        data = parse_obj_file(f)
+    vao = VertexArrayObject(vertices_class=ObjVertices)
+
+    def setup():
+        vao.create_vertices(data).delete()
+
+    return setup
+
+
+@benchmark("mesh_draw_100")
+def mesh_draw():
+    program = Program(VertexShader(EXAMPLES / "glsl/view_vertex.glsl"),
+                      FragmentShader(EXAMPLES / "glsl/view_fragment.glsl"))
+    mesh = ObjMesh(SUZANNE)
+    framebuffer = _framebuffer()
+    view_projection = gl_matrix(Matrix4.new_perspective(1, 1, 1, 20) * Matrix4.new_translate(0, 0, -5))
+    models = [gl_matrix(Matrix4.new_rotatey(2 * math.pi * i / 100)) for i in range(100)]
+
+    def draw():
+        with framebuffer, program, enabled(gl.GL_DEPTH_TEST):
+            gl.glUniformMatrix4fv(0, 1, gl.GL_FALSE, view_projection)
+            gl.glUniform4f(2, 0.3, 0.3, 1, 1)
+            for model in models:
+                gl.glUniformMatrix4fv(1, 1, gl.GL_FALSE, model)
+                mesh.draw()
+
+    return draw
+
+
+@benchmark("framebuffer_clear")
+def framebuffer_clear():
+    framebuffer = _framebuffer((1024, 1024))
+    return framebuffer.clear
+
+
+@benchmark("framebuffer_read_pixel")
+def framebuffer_read_pixel():
+    framebuffer = _framebuffer()
+    return lambda: framebuffer.read_pixel("position", 128, 128)
+
+
+@benchmark("framebuffer_read_image")
+def framebuffer_read_image():
+    framebuffer = _framebuffer((1024, 1024))
+    pixels = np.empty(1024 * 1024 * 4, dtype=np.uint8)
+
+    def read():
+        gl.glGetTextureImage(framebuffer["color"].name, 0, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE,
+                             pixels.nbytes, pixels.ctypes.data)
+
+    return read
+
+
+def _imgui(renderer_class):
+    renderer = renderer_class()
+    renderer.io.display_size = 1024, 768
+    imgui.new_frame()
+    imgui.show_test_window()
+    imgui.render()
+    draw_data = imgui.get_draw_data()
+    framebuffer = FrameBuffer((1024, 768), dict(color=Texture((1024, 768), unit=0)), set_viewport=True)
+
+    def render():
+        with framebuffer:
+            renderer.render(draw_data)
+
+    return render
+
+
+@benchmark("imgui_render")
+def imgui_render():
+    return _imgui(ProgrammablePipelineRenderer)
+
+
+@benchmark("imgui_render_persistent")
+def imgui_render_persistent():
+    return _imgui(PersistentPipelineRenderer)
@@ -0,0 +1,101 @@
+"""
+Timing benchmarks, saving the results and comparing them to a baseline.
+"""
+
+from datetime import datetime
+import json
+import platform
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, List, NamedTuple
+
+from pyglet import gl
+
+
+# name -> function doing the setup and returning the function to time
+BENCHMARKS: Dict[str, Callable[[], Callable[[], None]]] = {}
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark. The decorated function does any setup and returns
+    the function to time. GL work is waited for, so it's included.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class Result(NamedTuple):
+
+    median: float  # seconds per call
+    best: float
+    rounds: int
+    number: int  # calls per round
+
+
+def measure(function: Callable[[], None], rounds: int=5, round_time: float=0.1) -> Result:
+    "Time the function over a few rounds, each calling it enough times to take round_time."
+    function()  # Warm up; the first call may e.g. compile shaders
+    gl.glFinish()
+    start = perf_counter()
+    function()
+    gl.glFinish()
+    number = max(1, int(round_time / max(perf_counter() - start, 1e-9)))
+    times = []
+    for _ in range(rounds):
+        start = perf_counter()
+        for _ in range(number):
+            function()
+        gl.glFinish()
+        times.append((perf_counter() - start) / number)
+    return Result(median(times), min(times), rounds, number)
+
+
+def run(names: List[str]=None, rounds: int=5, round_time: float=0.1, log=print) -> Dict[str, Result]:
+    "Run the given benchmarks, by default all of them."
+    results = {}
+    for name in names or BENCHMARKS:
+        function = BENCHMARKS[name]()
+        results[name] = result = measure(function, rounds, round_time)
+        log(f"{name:32} {result.median * 1000:10.3f} ms  (best {result.best * 1000:.3f} ms, "
+            f"{result.rounds}x{result.number})")
+    return results
+
+
+def save(results: Dict[str, Result], path: str):
+    info = dict(
+        date=datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        renderer=gl.gl_info.get_renderer(),
+        version=gl.gl_info.get_version_string(),
+    )
+    with open(path, "w") as f:
+        json.dump(dict(info=info, results={name: result._asdict() for name, result in results.items()}),
+                  f, indent=2)
+
+
+def load(path: str) -> Dict[str, Result]:
+    with open(path) as f:
+        return {name: Result(**result) for name, result in json.load(f)["results"].items()}
+
+
+def compare(results: Dict[str, Result], baseline: Dict[str, Result], threshold: float=0.2,
+            log=print) -> List[str]:
+    """
+    Compare median times with the baseline. Returns the names of the benchmarks
+    that got slower by more than the threshold (a fraction).
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            log(f"{name:32} (not in baseline)")
+            continue
+        ratio = result.median / baseline[name].median
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        log(f"{name:32} {ratio:6.2f}x{'  SLOWER' if regressed else ''}")
+    return regressions
@@ -12,9 +12,13 @@ from pyglet import gl
 from euclid3 import Matrix4, Point3
 
 from fogl.debug import DebugWindow
+from fogl.debugoutput import DebugOutput
+from fogl.deletion import deletion_queue
 from fogl.framebuffer import FrameBuffer
 from fogl.glutil import gl_matrix
 from fogl.mesh import ObjMesh, Mesh
+from fogl.profiler import profiler
+from fogl.rendertarget import RenderTargetPool
 from fogl.shader import Program, VertexShader, FragmentShader
 from fogl.texture import ImageTexture, Texture, NormalTexture
 from fogl.util import try_except_log, load_png
@@ -71,32 +75,32 @@ class FoglWindow(pyglet.window.Window):
         
         self.vao = VertexArrayObject()
 
+        # Offscreen buffers that depend on the window size are handed out by a pool.
+        self.render_targets = RenderTargetPool()
+
     @debounce(0.1)  # Prevent too many events from accumulating
     def on_resize(self, width, height):
+        # The offscreen buffers are taken from the pool every frame, with the current size.
+        # Buffers of the old size will be deleted after a few frames of not being used.
         self.size = width, height
-        # We need to recreate the offscreen buffer if the window size changes
-        # This includes when the window is first created.
-        render_textures = dict(
-            # These will represent the different channels of the framebuffer,
-            # that the shader can render to.
-            color=Texture(self.size, unit=0),
-            normal=NormalTexture(self.size, unit=1),
-            position=NormalTexture(self.size, unit=2),
-        )
-        self.offscreen_buffer = FrameBuffer(self.size, render_textures, autoclear=True, set_viewport=True)
-        render_textures2 = dict(
-            color=Texture(self.size, unit=0),
-        )
-        self.offscreen_buffer2 = FrameBuffer(self.size, render_textures2, autoclear=True, set_viewport=True)
         return pyglet.event.EVENT_HANDLED  # Work around pyglet internals
 
     @try_except_log
     def on_draw(self):
 
         # Prevent trying to draw before things have been set up
-        if not hasattr(self, "offscreen_buffer"):
+        if not hasattr(self, "size"):
             return
 
+        self.offscreen_buffer = self.render_targets.framebuffer(
+            self.size,
+            # These will represent the different channels of the framebuffer,
+            # that the shader can render to.
+            dict(color=(Texture, 0), normal=(NormalTexture, 1), position=(NormalTexture, 2)),
+            autoclear=True, set_viewport=True)
+        self.offscreen_buffer2 = self.render_targets.framebuffer(
+            self.size, dict(color=(Texture, 0)), autoclear=True, set_viewport=True)
+
         # Model matrix we'll use to position the main model
         suzanne_model_matrix = (Matrix4
                                 .new_identity()
@@ -105,7 +109,7 @@ class FoglWindow(pyglet.window.Window):
         plane_model_matrix = Matrix4.new_rotatey(math.pi).translate(0, 0, 2)
         
         # Render to an offscreen buffer
-        with self.offscreen_buffer, self.view_program, \
+        with profiler.scope("gbuffer"), self.offscreen_buffer, self.view_program, \
                 enabled(gl.GL_DEPTH_TEST), disabled(gl.GL_CULL_FACE):
 
             gl.glDepthMask(gl.GL_TRUE)
@@ -147,7 +151,7 @@ class FoglWindow(pyglet.window.Window):
 
         # Render shadow buffer
         # Basically the same scene as above, but to a different buffer and from a different view
-        with self.shadow_buffer, self.view_program, enabled(gl.GL_DEPTH_TEST), disabled(gl.GL_CULL_FACE):
+        with profiler.scope("shadow"), self.shadow_buffer, self.view_program, enabled(gl.GL_DEPTH_TEST), disabled(gl.GL_CULL_FACE):
             gl.glDepthMask(gl.GL_TRUE)
 
             frustum = Matrix4.new_perspective(1, 1, 1, 12)
@@ -173,7 +177,7 @@ class FoglWindow(pyglet.window.Window):
         # lighting information to get a nice image.
         # Note: This step is pretty pointless here, as we might just draw directly to screen.
         # Just demonstrates how to do it.
-        with self.vao, self.offscreen_buffer2, self.lighting_program, disabled(gl.GL_CULL_FACE, gl.GL_DEPTH_TEST):
+        with profiler.scope("lighting"), self.vao, self.offscreen_buffer2, self.lighting_program, disabled(gl.GL_CULL_FACE, gl.GL_DEPTH_TEST):
             gl.glUniform3f(0, *light_pos)
             gl.glUniformMatrix4fv(1, 1, gl.GL_FALSE, gl_matrix(light_view_matrix))
             # Bind some of the offscreen buffer's textures so the shader can read them.
@@ -182,10 +186,15 @@ class FoglWindow(pyglet.window.Window):
                 gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
 
         # Now render the finished image to the screen
-        with self.vao, self.copy_program, disabled(gl.GL_CULL_FACE, gl.GL_DEPTH_TEST):
+        with profiler.scope("copy"), self.vao, self.copy_program, disabled(gl.GL_CULL_FACE, gl.GL_DEPTH_TEST):
             with self.offscreen_buffer2["color"]:
                 gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
 
+        self.render_targets.end_frame()
+        # Delete the GL objects dropped during the frame
+        deletion_queue.flush()
+        profiler.end_frame()
+
 
 if __name__ == "__main__":
 
@@ -200,6 +209,9 @@ if __name__ == "__main__":
     config.debug = True
 
     w = FoglWindow(config=config, resizable=True)
+    # Log GL errors and warnings as they happen
+    w.debug_output = DebugOutput(min_severity="medium")
+    w.debug_output.install()
     # DebugWindow()  # Simple helper that displays all the offscreen textures
 
     pyglet.clock.schedule_interval(lambda dt: None, 0.01)
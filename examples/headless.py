@@ -0,0 +1,74 @@
+"""
+Renders a bunch of images of a model from different angles, without opening a window,
+and reports the throughput.
+
+    $ env/bin/python examples/headless.py --jobs 100 --software
+"""
+
+import argparse
+import logging
+import math
+from pathlib import Path
+import tempfile
+
+# Must come first, see fogl.headless.
+from fogl.headless import create_context, BatchRenderer, Job
+
+from pyglet import gl
+from euclid3 import Matrix4
+
+from fogl.glutil import gl_matrix
+from fogl.mesh import ObjMesh
+from fogl.shader import Program, VertexShader, FragmentShader
+from fogl.texture import ImageTexture, NormalTexture
+from fogl.util import enabled, load_png
+
+
+def make_job(mesh, program, angle, filename):
+
+    def render(framebuffer):
+        with program, enabled(gl.GL_DEPTH_TEST):
+            frustum = Matrix4.new_perspective(1, 1, 1, 20)
+            view_matrix = Matrix4.new_identity().translate(0, 0, -5).rotatey(angle)
+            gl.glUniformMatrix4fv(0, 1, gl.GL_FALSE, gl_matrix(frustum * view_matrix))
+            gl.glUniformMatrix4fv(1, 1, gl.GL_FALSE, gl_matrix(Matrix4.new_rotatex(-math.pi/2)))
+            gl.glUniform4f(2, 0.3, 0.3, 1, 1)
+            mesh.draw()
+
+    return Job(render, filename)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--software", action="store_true", help="Use Mesa's llvmpipe renderer")
+    parser.add_argument("--output", default=None, help="Directory for the images (default: temporary)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    context = create_context(software=args.software)
+
+    local = Path(__file__).parent
+    program = Program(
+        VertexShader(local / "glsl/view_vertex.glsl"),
+        FragmentShader(local / "glsl/view_fragment.glsl")
+    )
+    texture = ImageTexture(*load_png(local / "textures/plasma.png"), unit=3)
+    suzanne = ObjMesh(local / "obj/suzanne.obj", texture=texture)
+
+    size = args.size, args.size
+    # The view shader also writes normals and positions
+    renderer = BatchRenderer(size, dict(normal=NormalTexture(size, unit=1),
+                                        position=NormalTexture(size, unit=2)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = Path(args.output or tmp)
+        jobs = (make_job(suzanne, program, 2 * math.pi * i / args.jobs, output / f"suzanne_{i:04d}.png")
+                for i in range(args.jobs))
+        stats = renderer.render(jobs)
+        renderer.delete()
+
+    print(f"{stats.images} images in {stats.seconds:.2f} s: {stats.images_per_second:.1f} images/s")
@@ -0,0 +1,211 @@
+"""
+Packing of many small images into texture atlases.
+
+Drawing lots of small textures means binding a texture for every draw. By
+packing the images into one (or a few) larger "pages" we can instead bind
+once and use the atlas coordinates to find each image, see
+ImageTexture.get_texture_coords.
+"""
+
+from hashlib import sha1
+import json
+import os
+from typing import Dict, List, Mapping, Tuple
+
+from pyglet import gl
+
+from .texture import ImageTexture, Texture3D
+
+
+# Image size and RGBA pixel data, as returned by util.load_png
+Image = Tuple[Tuple[int, int], bytes]
+
+# Position and size of an image in an atlas page, in pixels
+Rect = Tuple[int, int, int, int]
+
+
+class Skyline:
+
+    """
+    A simple "skyline" rectangle packer. Keeps track of the top edge of the
+    already placed rectangles, as a list of horizontal segments, and puts each new
+    rectangle as low (and then as far left) as possible.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.segments = [(0, 0, width)]  # (x, y, width)
+
+    def _fit(self, index, w, h):
+        "Return the lowest y where a w*h rect fits, starting at the given segment."
+        x, y, _ = self.segments[index]
+        if x + w > self.width:
+            return None
+        remaining = w
+        i = index
+        while remaining > 0:
+            if i == len(self.segments):
+                return None
+            _, sy, sw = self.segments[i]
+            y = max(y, sy)
+            if y + h > self.height:
+                return None
+            remaining -= sw
+            i += 1
+        return y
+
+    def insert(self, w: int, h: int):
+        "Place a rect of the given size. Return its position, or None if it won't fit."
+        best = None
+        for i in range(len(self.segments)):
+            y = self._fit(i, w, h)
+            if y is None:
+                continue
+            x = self.segments[i][0]
+            if best is None or (y + h, x) < (best[2] + h, best[1]):
+                best = i, x, y
+        if best is None:
+            return None
+        i, x, y = best
+        self._add_segment(i, x, y + h, w)
+        return x, y
+
+    def _add_segment(self, index, x, y, w):
+        segments = self.segments
+        segments.insert(index, (x, y, w))
+        # Shrink or remove the segments now covered by the new one
+        i = index + 1
+        while i < len(segments):
+            sx, sy, sw = segments[i]
+            end = x + w
+            if sx >= end:
+                break
+            if sx + sw <= end:
+                del segments[i]
+            else:
+                segments[i] = (end, sy, sw - (end - sx))
+                break
+        # Merge neighbours at the same height
+        i = 0
+        while i < len(segments) - 1:
+            x0, y0, w0 = segments[i]
+            _, y1, w1 = segments[i + 1]
+            if y0 == y1:
+                segments[i] = (x0, y0, w0 + w1)
+                del segments[i + 1]
+            else:
+                i += 1
+
+
+def _align(value, alignment):
+    return -(-value // alignment) * alignment
+
+
+def _cache_key(sizes, page_size, padding, alignment):
+    description = json.dumps([sorted(sizes.items()), page_size, padding, alignment])
+    return sha1(description.encode("utf-8")).hexdigest()
+
+
+def pack(sizes: Mapping[str, Tuple[int, int]], page_size: Tuple[int, int]=(1024, 1024),
+         padding: int=2, alignment: int=1, cache_dir: str=None) -> List[Dict[str, Rect]]:
+    """
+    Figure out where to put images of the given sizes. Returns a list of pages, each
+    a mapping from image name to (x, y, w, h) suitable as an ImageTexture atlas.
+
+    Each image gets "padding" pixels of space on all sides, which compose() fills
+    by repeating the edge pixels so that filtering does not bleed in neighbouring
+    images. Placing images on multiples of "alignment" (e.g. 4) keeps them apart
+    also in the first few mipmap levels.
+
+    If cache_dir is given, the result is stored there and reused next time the same
+    set of sizes is packed.
+    """
+    if cache_dir:
+        sizes = {name: tuple(size) for name, size in sizes.items()}
+        cache_file = os.path.join(cache_dir, f"atlas-{_cache_key(sizes, page_size, padding, alignment)}.json")
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                return [{name: tuple(rect) for name, rect in page.items()}
+                        for page in json.load(f)]
+
+    page_w, page_h = page_size
+    pages = []
+    packers = []
+    # Placing large images first gives a much better packing
+    for name, (w, h) in sorted(sizes.items(), key=lambda item: (-item[1][1], -item[1][0], item[0])):
+        padded_w = _align(w + 2 * padding, alignment)
+        padded_h = _align(h + 2 * padding, alignment)
+        if padded_w > page_w or padded_h > page_h:
+            raise ValueError(f"Image {name} ({w}x{h}) does not fit in atlas page {page_w}x{page_h}.")
+        for page, packer in zip(pages, packers):
+            position = packer.insert(padded_w, padded_h)
+            if position:
+                break
+        else:
+            page, packer = {}, Skyline(page_w, page_h)
+            pages.append(page)
+            packers.append(packer)
+            position = packer.insert(padded_w, padded_h)
+        x, y = position
+        page[name] = (x + padding, y + padding, w, h)
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file, "w") as f:
+            json.dump(pages, f)
+
+    return pages
+
+
+def compose(images: Mapping[str, Image], layout: Mapping[str, Rect],
+            page_size: Tuple[int, int], padding: int=2) -> bytearray:
+    "Copy the images into a single RGBA page, according to the layout given by pack()."
+    page_w, page_h = page_size
+    stride = 4 * page_w
+    page = bytearray(stride * page_h)
+    for name, (x, y, w, h) in layout.items():
+        _, pixels = images[name]
+        pixels = bytes(pixels)
+        row_size = 4 * w
+        rows = [pixels[row_size * i:row_size * (i + 1)] for i in range(h)]
+        for r in range(-padding, h + padding):
+            row = rows[min(max(r, 0), h - 1)]
+            # Extrude the edge pixels into the padding, to make it safe for filtering
+            row = row[:4] * padding + row + row[-4:] * padding
+            start = stride * (y + r) + 4 * (x - padding)
+            page[start:start + len(row)] = row
+    return page
+
+
+def build_atlases(images: Mapping[str, Image], page_size: Tuple[int, int]=(1024, 1024),
+                  padding: int=2, alignment: int=1, unit: int=0,
+                  cache_dir: str=None) -> List[ImageTexture]:
+    """
+    Pack the images (e.g. as loaded by util.load_png) into as few atlas textures
+    as possible. Use ImageTexture.get_texture_coords to look them up by name.
+    """
+    images = {name: (tuple(size), bytes(pixels)) for name, (size, pixels) in images.items()}
+    sizes = {name: size for name, (size, _) in images.items()}
+    layouts = pack(sizes, page_size, padding, alignment, cache_dir)
+    return [ImageTexture(page_size, compose(images, layout, page_size, padding), unit=unit, atlas=layout)
+            for layout in layouts]
+
+
+def build_array_texture(images: Mapping[str, Image], unit: int=0,
+                        params: Mapping[int, int]={}) -> Tuple[Texture3D, Dict[str, int]]:
+    """
+    An alternative to an atlas, when all images have the same size. Puts each image
+    in its own layer of a 2D array texture. Returns the texture and a mapping from
+    image name to layer index.
+    """
+    sizes = {tuple(size) for size, _ in images.values()}
+    if len(sizes) != 1:
+        raise ValueError(f"Array texture images must all have the same size, got {sizes}.")
+    w, h = sizes.pop()
+    texture = Texture3D((w, h, len(images)), unit=unit, params=params)
+    layers = {}
+    for layer, (name, (_, pixels)) in enumerate(sorted(images.items())):
+        texture.write_layer(layer, pixels)
+        layers[name] = layer
+    return texture, layers
@@ -3,7 +3,7 @@ General GL buffer handling
 """
 
 from array import array
-from ctypes import byref, sizeof, c_uint, c_ubyte, cast, c_void_p, memmove, POINTER
+from ctypes import byref, sizeof, c_ubyte, cast, c_void_p, memmove, POINTER
 from typing import List
 
 try:
@@ -12,6 +12,8 @@ except ImportError:
     np = None
 from pyglet import gl
 
+from .deletion import deletion_queue, release
+from .resources import registry
 from .util import LoggerMixin
 
 
@@ -21,7 +23,10 @@ class Buffer(LoggerMixin):
         self.name = gl.GLuint()
         self.structure = structure
         gl.glCreateBuffers(1, byref(self.name))
-        if size == 0 and len(data):
+        if size == 0 and np and isinstance(data, np.ndarray):
+            size = data.nbytes
+            length = size // sizeof(structure)
+        elif size == 0 and len(data):
             length = len(data)
             size = length * sizeof(structure)
         else:
@@ -31,17 +36,49 @@ class Buffer(LoggerMixin):
         if isinstance(data, list):
             gl.glNamedBufferStorage(self.name, size, (structure*len(data))(*data), flags)
         elif np and isinstance(data, np.ndarray):
-            gl.glNamedBufferStorage(self.name, size, data.ctypes.data, flags)            
+            data = np.ascontiguousarray(data)
+            gl.glNamedBufferStorage(self.name, size, data.ctypes.data, flags)
+        else:
+            gl.glNamedBufferStorage(self.name, size, None, flags)
+        registry.add(self, "buffer")
 
     def __len__(self):
         return self.length
 
     def write(self, data, offset=0):
-        gl.glNamedBufferSubData(self.name, offset, len(data)*sizeof(self.structure),
-                                (self.structure*len(data))(*data))
+        "Write a list or numpy array of data, starting at the given offset (in bytes)."
+        if np and isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data)
+            gl.glNamedBufferSubData(self.name, offset, data.nbytes, data.ctypes.data)
+        else:
+            gl.glNamedBufferSubData(self.name, offset, len(data)*sizeof(self.structure),
+                                    (self.structure*len(data))(*data))
+
+    def read(self, dtype="float32", offset: int=0, size: int=None):
+        "Copy the contents back from the GPU, as a numpy array. Waits for the GPU."
+        size = self.size - offset if size is None else size
+        result = np.empty(size // np.dtype(dtype).itemsize, dtype=dtype)
+        gl.glGetNamedBufferSubData(self.name, offset, result.nbytes, result.ctypes.data)
+        return result
+
+    def clear(self):
+        "Fill the buffer with zeros, e.g. to reset counters."
+        gl.glClearNamedBufferData(self.name, gl.GL_R8UI, gl.GL_RED_INTEGER, gl.GL_UNSIGNED_BYTE, None)
+
+    def bind_base(self, target, index: int):
+        "Bind to an indexed binding point, e.g. for shader storage or uniform blocks."
+        gl.glBindBufferBase(target, index, self.name)
+
+    def bind_storage(self, index: int):
+        "Bind as a shader storage buffer, for 'layout(std430, binding=index) buffer' blocks."
+        self.bind_base(gl.GL_SHADER_STORAGE_BUFFER, index)
+
+    def bind_atomic_counter(self, index: int):
+        "Bind for 'layout(binding=index) uniform atomic_uint' counters."
+        self.bind_base(gl.GL_ATOMIC_COUNTER_BUFFER, index)
 
     def delete(self):
-        gl.glDeleteBuffers(1, (c_uint*1)(self.name))
+        release(self, "buffer")
 
     def __del__(self):
         try:
@@ -50,18 +87,68 @@ class Buffer(LoggerMixin):
             pass
         
 
+# Index types, smallest first: (ctypes type, GL type, numpy type)
+INDEX_TYPES = [
+    (gl.GLubyte, gl.GL_UNSIGNED_BYTE, "u1"),
+    (gl.GLushort, gl.GL_UNSIGNED_SHORT, "u2"),
+    (gl.GLuint, gl.GL_UNSIGNED_INT, "u4"),
+]
+
+
+def index_type(largest: int, primitive_restart: bool=False):
+    """
+    The smallest index type (ctypes type, GL type, numpy type) that can hold indices up
+    to "largest". With primitive restart, the largest value of the type is reserved.
+    """
+    for index_type in INDEX_TYPES:
+        limit = 2 ** (8 * sizeof(index_type[0])) - 1
+        if largest < limit or (largest == limit and not primitive_restart):
+            return index_type
+    raise ValueError(f"Index {largest} is too large.")
+
+
 class IndexBuffer(Buffer):
 
-    def __init__(self, data: List[int], structure=gl.GLuint):
+    """
+    Vertex indices, stored in the smallest type that fits unless "structure" is given.
+    The GL type to draw with is in "gl_type".
+
+    With primitive_restart, negative indices mark where a new primitive (e.g. triangle
+    strip) starts. They are stored as the largest value of the type, as expected by
+    GL_PRIMITIVE_RESTART_FIXED_INDEX, which Vertices.draw enables.
+    """
+
+    def __init__(self, data: List[int], structure=None, primitive_restart: bool=False):
         self.name = gl.GLuint()
+        if np and isinstance(data, np.ndarray):
+            data = data.ravel()
+            largest = int(data.max()) if len(data) else 0
+        else:
+            data = list(data)
+            largest = max(data, default=0)
+        if structure is None:
+            structure, self.gl_type, dtype = index_type(largest, primitive_restart)
+        else:
+            structure, self.gl_type, dtype = next(t for t in INDEX_TYPES if t[0] == structure)
         self.structure = structure
+        self.primitive_restart = primitive_restart
+        restart_index = 2 ** (8 * sizeof(structure)) - 1
+        if np and isinstance(data, np.ndarray):
+            if primitive_restart:
+                data = np.where(data < 0, restart_index, data)
+            data = np.ascontiguousarray(data, dtype=dtype)
+            contents = data.ctypes.data
+        else:
+            if primitive_restart:
+                data = [restart_index if i < 0 else i for i in data]
+            contents = (structure*len(data))(*data)
         gl.glGenBuffers(1, byref(self.name))
         gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.name)
         self.length = len(data)
         self.size = self.length * sizeof(structure)
-        gl.glBufferData(gl.GL_ELEMENT_ARRAY_BUFFER, self.size, (structure*len(data))(*data),
-                        gl.GL_STATIC_DRAW)
+        gl.glBufferData(gl.GL_ELEMENT_ARRAY_BUFFER, self.size, contents, gl.GL_STATIC_DRAW)
         gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, 0)
+        registry.add(self, "index_buffer")
 
     def __enter__(self, *args):
         gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.name)
@@ -70,4 +157,76 @@ class IndexBuffer(Buffer):
         gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, 0)
 
     def __repr__(self):
-        return f"{self.__class__.__name__}(length={self.length})"
+        return f"{self.__class__.__name__}(length={self.length}, structure={self.structure.__name__})"
+
+
+class BufferRing(LoggerMixin):
+
+    """
+    A ring of persistently mapped buffers, each guarded by a fence. Useful for
+    streaming data to (or from) the GPU without stalling; while the GPU works on
+    the contents of one buffer, the CPU can fill the next one.
+
+    Use acquire() to get the next free buffer and its mapped memory, issue the GL
+    commands that use the buffer, then call release() to fence it.
+    """
+
+    def __init__(self, size: int, count: int=3, access=gl.GL_MAP_WRITE_BIT):
+        self.size = size
+        self.count = count
+        flags = access | gl.GL_MAP_PERSISTENT_BIT | gl.GL_MAP_COHERENT_BIT
+        self.names = (gl.GLuint * count)()
+        gl.glCreateBuffers(count, self.names)
+        self.addresses = []
+        for name in self.names:
+            gl.glNamedBufferStorage(name, size, None, flags)
+            pointer = gl.glMapNamedBufferRange(name, 0, size, flags)
+            self.addresses.append(cast(pointer, c_void_p).value)
+        self.fences = [None] * count
+        self.index = 0
+        self.stalls = 0  # Number of times we had to wait for the GPU
+        registry.add(self, "buffer")
+
+    def wait(self, index: int, timeout: int=1_000_000):
+        "Block until the GPU is done with the given buffer."
+        fence = self.fences[index]
+        if fence is None:
+            return
+        result = gl.glClientWaitSync(fence, gl.GL_SYNC_FLUSH_COMMANDS_BIT, 0)
+        if result == gl.GL_TIMEOUT_EXPIRED:
+            self.stalls += 1
+            while result == gl.GL_TIMEOUT_EXPIRED:
+                result = gl.glClientWaitSync(fence, gl.GL_SYNC_FLUSH_COMMANDS_BIT, timeout)
+        gl.glDeleteSync(fence)
+        self.fences[index] = None
+
+    def is_ready(self, index: int):
+        "Check, without blocking, whether the GPU is done with the given buffer."
+        fence = self.fences[index]
+        return fence is None or gl.glClientWaitSync(fence, 0, 0) != gl.GL_TIMEOUT_EXPIRED
+
+    def acquire(self):
+        "Return the name and memory address of the next buffer, once it's free."
+        self.wait(self.index)
+        return self.names[self.index], self.addresses[self.index]
+
+    def release(self):
+        "Mark the current buffer as in use by the GL commands issued so far, and move on."
+        self.fences[self.index] = gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.index = (self.index + 1) % self.count
+
+    def delete(self):
+        if getattr(self, "_released", False):
+            return
+        self._released = True
+        registry.remove(self)
+        for fence in self.fences:
+            if fence is not None:
+                gl.glDeleteSync(fence)
+        self.fences = [None] * self.count
+        for name in self.names:
+            gl.glUnmapNamedBuffer(name)
+            deletion_queue.push("buffer", name)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(size={self.size}, count={self.count})"
@@ -0,0 +1,338 @@
+"""
+Bounding volume hierarchy (BVH) for fast ray casting against meshes on the CPU,
+e.g. for finding out what's under the mouse cursor.
+
+Everything is done with numpy, working on many nodes/rays at a time instead of
+recursing in python. The tree is stored as flat arrays.
+"""
+
+from typing import Iterable, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from pyglet import gl
+
+
+def _spread_bits(values):
+    "Insert two zero bits between each of the lower 10 bits."
+    v = values.astype(np.uint32) & 0x3ff
+    v = (v | (v << 16)) & 0x030000ff
+    v = (v | (v << 8)) & 0x0300f00f
+    v = (v | (v << 4)) & 0x030c30c3
+    v = (v | (v << 2)) & 0x09249249
+    return v
+
+
+def morton_codes(points):
+    "30 bit Morton (Z-order) codes for the points, which are normalized to their bounds."
+    lo = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - lo, 1e-12)
+    cells = ((points - lo) / extent * 1023).astype(np.uint32)
+    return (_spread_bits(cells[:, 0]) << 2) | (_spread_bits(cells[:, 1]) << 1) | _spread_bits(cells[:, 2])
+
+
+def _range_min(padded, starts, ends):
+    """
+    Minimum over each range [start, end) of the rows. Ranges must not be empty, and
+    the array must have an extra row at the end (so that end can be the length).
+    """
+    indices = np.empty(2 * len(starts), dtype=np.intp)
+    indices[0::2] = starts
+    indices[1::2] = ends
+    return np.minimum.reduceat(padded, indices, axis=0)[0::2]
+
+
+def _surface_area(lo, hi):
+    d = hi - lo
+    return d[..., 0] * d[..., 1] + d[..., 1] * d[..., 2] + d[..., 2] * d[..., 0]
+
+
+def _cross(a, b):
+    return np.stack([a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1],
+                     a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2],
+                     a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]], axis=1)
+
+
+def triangles_from_mode(n_vertices: int, mode=gl.GL_TRIANGLES, indices: Sequence[int]=None):
+    """
+    Vertex indices, shape (n, 3), of the triangles drawn with the given GL mode.
+    In strips, negative indices are taken as primitive restarts.
+    """
+    indices = np.arange(n_vertices) if indices is None else np.asarray(indices)
+    if mode == gl.GL_TRIANGLES:
+        return indices[:len(indices) // 3 * 3].reshape(-1, 3)
+    if mode == gl.GL_TRIANGLE_STRIP:
+        i = np.arange(max(len(indices) - 2, 0))
+        restart = indices < 0
+        strip_start = np.maximum.accumulate(np.where(restart, np.arange(len(indices)) + 1, 0))
+        odd = (i - strip_start[i]) % 2 == 1
+        # Every other triangle in a strip has reversed winding
+        first = np.where(odd, indices[i + 1], indices[i])
+        second = np.where(odd, indices[i], indices[i + 1])
+        valid = ~(restart[i] | restart[i + 1] | restart[i + 2])
+        return np.stack([first, second, indices[i + 2]], axis=1)[valid]
+    raise ValueError(f"Can't make triangles from GL mode {mode}.")
+
+
+class RayHits(NamedTuple):
+
+    "Results of casting a bunch of rays. Triangle is -1 for rays that missed."
+
+    distance: np.ndarray  # In units of the ray direction's length
+    triangle: np.ndarray
+    barycentrics: np.ndarray  # Shape (n, 3), weights of the triangle's vertices
+
+
+class BVH:
+
+    """
+    A binary tree of axis aligned boxes, where each leaf contains up to
+    "leaf_size" triangles.
+
+    Building sorts the triangles along a Morton curve, which makes nearby triangles
+    end up next to each other, and then splits each node's range of triangles in
+    two, top down, one level at a time. For nodes with more than "sah_threshold"
+    triangles, the split point is chosen among a number of evenly spaced candidates
+    using the surface area heuristic (SAH).
+    """
+
+    chunk_size = 16
+
+    def __init__(self, positions, triangles, leaf_size: int=4, split_candidates: int=8,
+                 sah_threshold: int=256):
+        self.leaf_size = max(1, leaf_size)
+        self.split_candidates = split_candidates
+        # Must be large enough that every bin gets at least one chunk
+        self.sah_threshold = max(sah_threshold, self.chunk_size * (split_candidates + 1))
+        self.triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        if len(self.triangles) == 0:
+            raise ValueError("Can't build a BVH without triangles.")
+        self._set_positions(positions)
+        self.order = np.argsort(morton_codes(self._centroids()), kind="stable")
+        self._build()
+
+    @classmethod
+    def from_mesh(cls, mesh, mode=None, **kwargs):
+        "Build from the data of a Mesh (or anything with the position first in each vertex)."
+        positions = np.array([vertex[0] for vertex in mesh.data], dtype=np.float32)
+        mode = getattr(mesh, "mode", gl.GL_TRIANGLES) if mode is None else mode
+        return cls(positions, triangles_from_mode(len(positions), mode, getattr(mesh, "indices", None)), **kwargs)
+
+    def _set_positions(self, positions):
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        p0, p1, p2 = (positions[self.triangles[:, i]] for i in range(3))
+        self.v0 = p0
+        self.e1 = p1 - p0
+        self.e2 = p2 - p0
+        self.triangle_lo = np.minimum(np.minimum(p0, p1), p2)
+        self.triangle_hi = np.maximum(np.maximum(p0, p1), p2)
+
+    def _centroids(self):
+        return (self.triangle_lo + self.triangle_hi) / 2
+
+    def _sorted_bounds(self):
+        """
+        Triangle bounds in tree order, as rows of (lo, -hi) so that a single
+        minimum gives both the lower and the upper bounds of a group.
+        """
+        bounds = np.concatenate([self.triangle_lo, -self.triangle_hi], axis=1)[self.order]
+        return np.concatenate([bounds, bounds[:1]])
+
+    def _build(self):
+        bounds = self._sorted_bounds()
+        # Bounds of fixed size chunks of triangles, to speed up the SAH binning
+        n_triangles = len(self.order)
+        chunk_starts = np.arange(0, n_triangles, self.chunk_size)
+        chunk_bounds = _range_min(bounds, chunk_starts, np.minimum(chunk_starts + self.chunk_size, n_triangles))
+        chunk_bounds = np.concatenate([chunk_bounds, chunk_bounds[:1]])
+        starts = np.array([0])
+        ends = np.array([len(self.order)])
+        levels = []
+        count = 1  # nodes so far
+        while len(starts):
+            n = ends - starts
+            split = n > self.leaf_size
+            left = np.full(len(n), -1, dtype=np.intp)
+            n_split = int(split.sum())
+            left[split] = count + 2 * np.arange(n_split)
+            levels.append((starts, ends, left))
+
+            # Small nodes are just split in the middle; the Morton order keeps that decent.
+            s, e = starts[split], ends[split]
+            middle = (s + e) // 2
+            large = e - s > self.sah_threshold
+            if large.any():
+                middle[large] = self._sah_split(chunk_bounds, s[large], e[large])
+
+            starts = np.stack([s, middle], axis=1).ravel()
+            ends = np.stack([middle, e], axis=1).ravel()
+            count += 2 * n_split
+
+        self.start, self.end, self.left = (np.concatenate(arrays) for arrays in zip(*levels))
+        # Node indices at each depth, for computing bounds bottom up
+        offsets = np.cumsum([0] + [len(level[0]) for level in levels])
+        self.levels = [np.arange(a, b) for a, b in zip(offsets[:-1], offsets[1:])]
+        self._update_bounds(bounds)
+
+    def _sah_split(self, chunk_bounds, starts, ends):
+        """
+        Split each node's range into bins of whole chunks, and return the bin edge
+        where splitting gives the lowest SAH cost. Since the splits are at chunk edges,
+        the nodes large enough to get here always start at one too.
+        """
+        bins = self.split_candidates + 1
+        first = starts // self.chunk_size
+        n = -(-ends // self.chunk_size) - first
+        edges = first[:, None] + (n[:, None] * np.arange(bins + 1)) // bins
+        bin_bounds = _range_min(chunk_bounds, edges[:, :-1].ravel(), edges[:, 1:].ravel())
+        bin_bounds = bin_bounds.reshape(len(n), bins, 6)
+        left = np.minimum.accumulate(bin_bounds, axis=1)[:, :-1]
+        right = np.minimum.accumulate(bin_bounds[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        candidates = edges[:, 1:-1] * self.chunk_size
+        cost = (_surface_area(left[..., :3], -left[..., 3:]) * (candidates - starts[:, None])
+                + _surface_area(right[..., :3], -right[..., 3:]) * (ends[:, None] - candidates))
+        return candidates[np.arange(len(n)), cost.argmin(axis=1)]
+
+    def _update_bounds(self, bounds):
+        leaves = np.flatnonzero(self.left < 0)
+        node_bounds = np.empty((len(self.left), 6), dtype=np.float32)
+        node_bounds[leaves] = _range_min(bounds, self.start[leaves], self.end[leaves])
+        for level in reversed(self.levels):
+            nodes = level[self.left[level] >= 0]
+            children = self.left[nodes]
+            node_bounds[nodes] = np.minimum(node_bounds[children], node_bounds[children + 1])
+        self.lo = np.ascontiguousarray(node_bounds[:, :3])
+        self.hi = -node_bounds[:, 3:]
+
+    def __len__(self):
+        "Number of nodes."
+        return len(self.left)
+
+    def refit(self, positions):
+        """
+        Update the bounds for new vertex positions, e.g. after animation, keeping
+        the tree structure. Much faster than rebuilding, but the tree gets less
+        efficient if the triangles move around a lot.
+        """
+        self._set_positions(positions)
+        self._update_bounds(self._sorted_bounds())
+
+    def _leaf_triangles(self, nodes):
+        "Return, for leaf nodes, (index into nodes, triangle) for all their triangles."
+        counts = self.end[nodes] - self.start[nodes]
+        which = np.repeat(np.arange(len(nodes)), counts)
+        first = np.repeat(np.cumsum(counts) - counts, counts)
+        slots = self.start[nodes][which] + np.arange(counts.sum()) - first
+        return which, self.order[slots]
+
+    def intersect(self, origins, directions, max_distance: float=np.inf) -> RayHits:
+        "Find the closest triangle hit by each ray. Takes arrays of shape (n, 3)."
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        n_rays = len(origins)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverse = 1 / directions
+        best = np.full(n_rays, max_distance, dtype=np.float64)
+        triangle = np.full(n_rays, -1, dtype=np.int64)
+        uv = np.zeros((n_rays, 2))
+
+        # Traverse breadth first, keeping a list of (ray, node) pairs to test
+        rays = np.arange(n_rays)
+        nodes = np.zeros(n_rays, dtype=np.intp)
+        while len(rays):
+            with np.errstate(invalid="ignore"):
+                t1 = (self.lo[nodes] - origins[rays]) * inverse[rays]
+                t2 = (self.hi[nodes] - origins[rays]) * inverse[rays]
+            near = np.fmax.reduce(np.fmin(t1, t2), axis=1)
+            far = np.fmin.reduce(np.fmax(t1, t2), axis=1)
+            hit = (far >= np.maximum(near, 0)) & (near <= best[rays])
+            rays, nodes = rays[hit], nodes[hit]
+
+            leaf = self.left[nodes] < 0
+            if leaf.any():
+                self._intersect_leaves(rays[leaf], nodes[leaf], origins, directions, best, triangle, uv)
+            rays, nodes = rays[~leaf], self.left[nodes[~leaf]]
+            rays = np.repeat(rays, 2)
+            nodes = np.stack([nodes, nodes + 1], axis=1).ravel()
+
+        u, v = uv[:, 0], uv[:, 1]
+        barycentrics = np.stack([1 - u - v, u, v], axis=1)
+        barycentrics[triangle < 0] = 0
+        distance = np.where(triangle < 0, np.inf, best)
+        return RayHits(distance, triangle, barycentrics)
+
+    def _intersect_leaves(self, rays, nodes, origins, directions, best, triangle, uv):
+        # Möller-Trumbore ray/triangle intersection
+        which, triangles = self._leaf_triangles(nodes)
+        rays = rays[which]
+        d = directions[rays]
+        e1, e2 = self.e1[triangles], self.e2[triangles]
+        p = _cross(d, e2)
+        det = (e1 * p).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_det = 1 / det
+            s = origins[rays] - self.v0[triangles]
+            u = (s * p).sum(axis=1) * inv_det
+            q = _cross(s, e1)
+            v = (d * q).sum(axis=1) * inv_det
+            t = (e2 * q).sum(axis=1) * inv_det
+            hit = ((np.abs(det) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1)
+                   & (t > 0) & (t < best[rays]))
+        if not hit.any():
+            return
+        rays, triangles, t, u, v = rays[hit], triangles[hit], t[hit], u[hit], v[hit]
+        np.minimum.at(best, rays, t)
+        closest = t == best[rays]
+        rays = rays[closest]
+        triangle[rays] = triangles[closest]
+        uv[rays, 0] = u[closest]
+        uv[rays, 1] = v[closest]
+
+    def query_box(self, lo, hi) -> np.ndarray:
+        "Return the (sorted) indices of all triangles whose bounds overlap the given box."
+        lo = np.asarray(lo, dtype=np.float32)
+        hi = np.asarray(hi, dtype=np.float32)
+        nodes = np.zeros(1, dtype=np.intp)
+        found = []
+        while len(nodes):
+            overlap = np.all((self.lo[nodes] <= hi) & (self.hi[nodes] >= lo), axis=1)
+            nodes = nodes[overlap]
+            leaf = self.left[nodes] < 0
+            if leaf.any():
+                _, triangles = self._leaf_triangles(nodes[leaf])
+                overlap = np.all((self.triangle_lo[triangles] <= hi) & (self.triangle_hi[triangles] >= lo), axis=1)
+                found.append(triangles[overlap])
+            children = self.left[nodes[~leaf]]
+            nodes = np.stack([children, children + 1], axis=1).ravel()
+        return np.sort(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+
+class Hit(NamedTuple):
+
+    mesh: object
+    triangle: int
+    distance: float
+    barycentrics: Tuple[float, float, float]
+
+
+def pick(objects: Iterable[Tuple[object, Sequence[float]]],
+         origin: Sequence[float], direction: Sequence[float]) -> Optional[Hit]:
+    """
+    Cast a ray through a number of (mesh, model matrix) pairs and return the closest hit,
+    if any. The matrices are 16 floats in GL (column major) order, e.g. euclid3 Matrix4,
+    or None for no transformation. Meshes need a "bvh" attribute, like Mesh has.
+    """
+    origin = np.array([*origin, 1], dtype=np.float64)
+    direction = np.array([*direction, 0], dtype=np.float64)
+    closest = None
+    for mesh, model_matrix in objects:
+        if model_matrix is None:
+            local_origin, local_direction = origin, direction
+        else:
+            # Transform the ray into the mesh's space, instead of all the triangles.
+            inverse = np.linalg.inv(np.array(list(model_matrix), dtype=np.float64).reshape(4, 4).T)
+            local_origin, local_direction = inverse @ origin, inverse @ direction
+        hits = mesh.bvh.intersect(local_origin[:3], local_direction[:3])
+        if hits.triangle[0] >= 0 and (closest is None or hits.distance[0] < closest.distance):
+            closest = Hit(mesh, int(hits.triangle[0]), float(hits.distance[0]),
+                          tuple(hits.barycentrics[0]))
+    return closest
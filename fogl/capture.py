@@ -0,0 +1,133 @@
+"""
+Recording of rendered frames to image sequences, without stalling the render loop.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from ctypes import string_at
+import os
+from threading import BoundedSemaphore
+from typing import Tuple
+
+from pyglet import gl
+
+from .buffer import BufferRing
+from .framebuffer import FrameBuffer
+from .util import LoggerMixin, write_png
+
+
+# What to do when encoding can't keep up
+DROP = "drop"  # Skip frames
+BLOCK = "block"  # Wait, slowing down rendering
+
+
+def write_raw(filename, size, data):
+    "Write the RGBA data as is, bottom row first."
+    with open(filename, "wb") as f:
+        f.write(data)
+
+
+ENCODERS = {
+    "png": write_png,
+    "raw": write_raw,
+}
+
+
+class FrameCapture(LoggerMixin):
+
+    """
+    Captures frames from a FrameBuffer texture (by default "color"), or from the
+    default framebuffer if none is given, and writes them as numbered files to a
+    directory. Call capture() once per frame, after rendering (and before swapping
+    buffers, when capturing the window).
+
+    The pixels are read into a ring of fenced pixel pack buffers and only copied
+    out once the GPU is done, a few frames later. They are then queued for encoding
+    in a pool of processes (or threads). If more than "max_queued" frames are
+    waiting to be encoded, the policy decides whether to drop the frame or to wait.
+
+    Call finish() when done, to write any remaining frames.
+    """
+
+    def __init__(self, directory: str, size: Tuple[int, int], framebuffer: FrameBuffer=None,
+                 texture: str="color", format: str="png", in_flight: int=3, max_queued: int=8,
+                 policy: str=DROP, workers: int=None, processes: bool=True):
+        if policy not in (DROP, BLOCK):
+            raise ValueError(f"Unknown capture policy {policy}.")
+        self.directory = directory
+        self.size = w, h = size
+        self.framebuffer = framebuffer
+        self.texture = texture
+        self.format = format
+        self.encoder = ENCODERS[format]
+        self.policy = policy
+        os.makedirs(directory, exist_ok=True)
+
+        self.ring = BufferRing(4 * w * h, in_flight, access=gl.GL_MAP_READ_BIT)
+        self._pending = deque()  # (ring index, frame number) waiting for the GPU
+        self._queue_slots = BoundedSemaphore(max_queued)
+        self._futures = []
+        executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.executor = executor_class(workers)
+
+        self.frame = 0
+        self.captured = 0
+        self.dropped = 0
+
+    def capture(self):
+        "Start reading back the current frame."
+        self._collect()
+        if len(self._pending) == self.ring.count:
+            # The GPU is behind; we have to wait for the oldest frame.
+            self._collect_one()
+        buffer_name, _ = self.ring.acquire()
+        if self.framebuffer:
+            # The attachment isn't necessarily given by the texture's unit
+            gl.glNamedFramebufferReadBuffer(self.framebuffer.name,
+                                            self.framebuffer._color_attachments[self.texture])
+            gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.framebuffer.name)
+        else:
+            gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, 0)
+            gl.glReadBuffer(gl.GL_BACK)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buffer_name)
+        gl.glReadPixels(0, 0, *self.size, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, None)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, 0)
+        self._pending.append((self.ring.index, self.frame))
+        self.ring.release()
+        self.frame += 1
+
+    def _collect(self):
+        "Hand over the frames that the GPU is done with."
+        while self._pending and self.ring.is_ready(self._pending[0][0]):
+            self._collect_one()
+
+    def _collect_one(self):
+        index, frame = self._pending.popleft()
+        self.ring.wait(index)
+        if not self._queue_slots.acquire(blocking=self.policy == BLOCK):
+            self.dropped += 1
+            return
+        data = string_at(self.ring.addresses[index], self.ring.size)
+        filename = os.path.join(self.directory, f"{frame:06d}.{self.format}")
+        future = self.executor.submit(self.encoder, filename, self.size, data)
+        future.add_done_callback(lambda _: self._queue_slots.release())
+        self._futures.append(future)
+        self.captured += 1
+        # Check for errors and forget about finished frames
+        while self._futures and self._futures[0].done():
+            self._futures.pop(0).result()
+
+    def finish(self):
+        "Wait for all frames to be written."
+        while self._pending:
+            self._collect_one()
+        for future in self._futures:
+            future.result()
+        self._futures.clear()
+        self.executor.shutdown()
+        self.ring.delete()
+        self.logger.info("Captured %d frames, dropped %d", self.captured, self.dropped)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(captured={self.captured}, dropped={self.dropped})"
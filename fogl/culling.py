@@ -0,0 +1,159 @@
+"""
+View frustum culling, i.e. skipping objects that are not on screen.
+
+Objects are given as (mesh, model matrix) pairs, where the mesh has "bounds"
+(like Mesh) and the matrix is 16 floats in GL (column major) order, e.g. a
+euclid3 Matrix4. Everything is tested at once, using numpy.
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+def to_array(matrix):
+    "Convert a GL style (column major) matrix to a row major numpy array."
+    return np.array(list(matrix), dtype=np.float64).reshape(4, 4).T
+
+
+def frustum_planes(view_projection) -> np.ndarray:
+    """
+    The six planes (left, right, bottom, top, near, far) of the view frustum, as an
+    array of shape (6, 4). A point p is inside a plane (a, b, c, d) if a*x + b*y + c*z + d >= 0.
+    """
+    m = to_array(view_projection)
+    planes = np.array([m[3] + m[0], m[3] - m[0],
+                       m[3] + m[1], m[3] - m[1],
+                       m[3] + m[2], m[3] - m[2]])
+    return planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+
+
+def transform_boxes(lo, hi, matrices):
+    "Axis aligned world space boxes around model space boxes transformed by the matrices."
+    center = (lo + hi) / 2
+    extent = (hi - lo) / 2
+    world_center = np.einsum("nij,nj->ni", matrices[:, :3, :3], center) + matrices[:, :3, 3]
+    world_extent = np.einsum("nij,nj->ni", np.abs(matrices[:, :3, :3]), extent)
+    return world_center - world_extent, world_center + world_extent
+
+
+def classify_boxes(planes, lo, hi):
+    "Return two boolean arrays, telling which boxes are completely outside and inside the frustum."
+    center = (lo + hi) / 2
+    extent = (hi - lo) / 2
+    distance = center @ planes[:, :3].T + planes[:, 3]
+    radius = extent @ np.abs(planes[:, :3]).T
+    return np.any(distance < -radius, axis=1), np.all(distance >= radius, axis=1)
+
+
+def world_bounds(objects: Sequence[Tuple[object, Sequence[float]]]):
+    "World space bounding boxes, arrays of shape (n, 3), of (mesh, model matrix) pairs."
+    lo = np.array([mesh.bounds[0] for mesh, _ in objects], dtype=np.float64).reshape(-1, 3)
+    hi = np.array([mesh.bounds[1] for mesh, _ in objects], dtype=np.float64).reshape(-1, 3)
+    matrices = np.array([to_array(matrix) if matrix is not None else np.eye(4)
+                         for _, matrix in objects]).reshape(-1, 4, 4)
+    return transform_boxes(lo, hi, matrices)
+
+
+def cull(view_projection, objects: Sequence[Tuple[object, Sequence[float]]]) -> List[Tuple[object, Sequence[float]]]:
+    "Return the (mesh, model matrix) pairs that may be visible."
+    if not objects:
+        return []
+    outside, _ = classify_boxes(frustum_planes(view_projection), *world_bounds(objects))
+    return [obj for obj, out in zip(objects, outside) if not out]
+
+
+class Octree:
+
+    """
+    For culling lots of static objects. Objects are put in the smallest octree
+    node that completely contains them, so that whole branches of the tree can be
+    skipped, or accepted, without testing every object.
+
+    Objects are stored in depth first order, so that all the objects in a branch
+    are in one range.
+    """
+
+    def __init__(self, objects: Sequence[Tuple[object, Sequence[float]]],
+                 max_objects: int=16, max_depth: int=8):
+        self.objects = list(objects)
+        self.max_objects = max_objects
+        self.max_depth = max_depth
+        self.object_lo, self.object_hi = world_bounds(self.objects)
+
+        self.order = []  # Object indices, depth first
+        self._nodes = []  # (start, own end, end, children)
+        if self.objects:
+            lo, hi = self.object_lo.min(axis=0), self.object_hi.max(axis=0)
+            size = (hi - lo).max()
+            self._build(np.arange(len(self.objects)), lo, lo + size, 0)
+        self.order = np.array(self.order, dtype=np.intp)
+
+        n = len(self._nodes)
+        self.start, self.own_end, self.end = (np.array([node[i] for node in self._nodes], dtype=np.intp)
+                                              for i in range(3))
+        # Children stored as ranges in one array
+        self.children = np.array([c for node in self._nodes for c in node[3]], dtype=np.intp)
+        counts = np.array([len(node[3]) for node in self._nodes], dtype=np.intp)
+        self.first_child = np.cumsum(counts) - counts
+        self.child_count = counts
+        # Tight bounds of everything in each branch
+        self.lo = np.empty((n, 3))
+        self.hi = np.empty((n, 3))
+        for i in range(n):
+            objects = self.order[self.start[i]:self.end[i]]
+            self.lo[i] = self.object_lo[objects].min(axis=0)
+            self.hi[i] = self.object_hi[objects].max(axis=0)
+
+    def _build(self, indices, lo, hi, depth):
+        node = len(self._nodes)
+        self._nodes.append(None)
+        start = len(self.order)
+        children = []
+        if len(indices) <= self.max_objects or depth == self.max_depth:
+            own = indices
+            octants = []
+        else:
+            middle = (lo + hi) / 2
+            o_lo, o_hi = self.object_lo[indices], self.object_hi[indices]
+            above = o_lo >= middle
+            below = o_hi <= middle
+            fits = np.all(above | below, axis=1)
+            own = indices[~fits]
+            octant = (above[fits] * [1, 2, 4]).sum(axis=1)
+            octants = [(i, indices[fits][octant == i]) for i in range(8)]
+        self.order.extend(own)
+        own_end = len(self.order)
+        for i, members in octants:
+            if len(members):
+                corner = np.array([i & 1, (i >> 1) & 1, (i >> 2) & 1])
+                child_lo = lo + corner * (hi - lo) / 2
+                children.append(self._build(members, child_lo, child_lo + (hi - lo) / 2, depth + 1))
+        self._nodes[node] = (start, own_end, len(self.order), children)
+        return node
+
+    def cull(self, view_projection) -> List[Tuple[object, Sequence[float]]]:
+        "Return the (mesh, model matrix) pairs that may be visible."
+        if not self.objects:
+            return []
+        planes = frustum_planes(view_projection)
+        visible = []
+        to_test = []
+        nodes = np.zeros(1, dtype=np.intp)
+        while len(nodes):
+            outside, inside = classify_boxes(planes, self.lo[nodes], self.hi[nodes])
+            for node in nodes[inside]:
+                visible.append(self.order[self.start[node]:self.end[node]])
+            nodes = nodes[~outside & ~inside]
+            for node in nodes:
+                to_test.append(self.order[self.start[node]:self.own_end[node]])
+            counts = self.child_count[nodes]
+            first = np.repeat(self.first_child[nodes] - (np.cumsum(counts) - counts), counts)
+            nodes = self.children[first + np.arange(counts.sum())]
+        if to_test:
+            candidates = np.concatenate(to_test)
+            outside, _ = classify_boxes(planes, self.object_lo[candidates], self.object_hi[candidates])
+            visible.append(candidates[~outside])
+        if not visible:
+            return []
+        return [self.objects[i] for i in np.sort(np.concatenate(visible))]
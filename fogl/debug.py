@@ -1,19 +1,19 @@
-import gc
-
 import imgui
 import pyglet
 from pyglet import gl
 
-from .framebuffer import FrameBuffer
 from .texture import DepthTexture
-from .imgui_pyglet import PygletRenderer
+from .imgui_pyglet import FastPygletRenderer
+from .deletion import deletion_queue
+from .profiler import profiler
+from .resources import registry
 
 
 class DebugWindow(pyglet.window.Window):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs, resizable=True)
-        self.imgui_renderer = PygletRenderer(self)
+        self.imgui_renderer = FastPygletRenderer(self)
         self.current_framebuffer = 0
     
     def on_draw(self):
@@ -22,18 +22,45 @@ class DebugWindow(pyglet.window.Window):
         imgui.new_frame()
         
         imgui.begin("FrameBuffer", True)
-        fbs = [o for o in gc.get_referrers(FrameBuffer) if isinstance(o, FrameBuffer)]
+        fbs = registry.resources("framebuffer")
         gl.glClearColor(0, 0, 0, 1)
         gl.glClear(gl.GL_COLOR_BUFFER_BIT)
-        clicked, self.current_framebuffer = imgui.combo("FrameBuffer",
-                                                        self.current_framebuffer,
-                                                        [str(fb) for fb in fbs])
+        if fbs:
+            self.current_framebuffer = min(self.current_framebuffer, len(fbs) - 1)
+            clicked, self.current_framebuffer = imgui.combo("FrameBuffer",
+                                                            self.current_framebuffer,
+                                                            [str(fb) for fb in fbs])
+
+            fb = fbs[self.current_framebuffer]
+            w, h = fb.size
+            for name, tex in fb.textures.items():
+                imgui.text(name)
+                imgui.image(tex.name, 200, 200 * h/w)
+        imgui.end()
+
+        imgui.begin("Resources", True)
+        for category, (count, size, peak) in sorted(registry.summary().items()):
+            imgui.text(f"{category}: {count} ({size / 2**20:.1f} MB, peak {peak / 2**20:.1f} MB)")
+        imgui.text(f"Leaked: {len(registry.leaks)}")
+        imgui.text(f"Waiting for deletion: {len(deletion_queue)}")
+        imgui.end()
 
-        fb = fbs[self.current_framebuffer]
-        w, h = fb.size
-        for name, tex in fb.textures.items():
-            imgui.text(name)
-            imgui.image(tex.name, 200, 200 * h/w)
+        imgui.begin("Profiler", True)
+        imgui.text("Median (95th percentile) in ms")
+        imgui.columns(3)
+        for text in ("Scope", "CPU", "GPU"):
+            imgui.text(text)
+            imgui.next_column()
+        for path, timing in profiler.timings().items():
+            imgui.text("  " * timing.depth + path.rsplit("/", 1)[-1])
+            imgui.next_column()
+            imgui.text(f"{timing.cpu_median:.2f} ({timing.cpu_p95:.2f})")
+            imgui.next_column()
+            imgui.text(f"{timing.gpu_median:.2f} ({timing.gpu_p95:.2f})")
+            imgui.next_column()
+        imgui.columns(1)
+        if imgui.button("Save trace"):
+            profiler.export_chrome_trace("trace.json")
         imgui.end()
             
         imgui.render()
@@ -0,0 +1,228 @@
+"""
+GL debug output, delivered through a callback instead of polling get_error_log
+or calling glGetError, which both make the CPU wait for the GPU.
+
+Messages are filtered by severity (by the driver) and by source and type,
+repeated messages are only logged once, and logging is rate limited. Driver
+performance warnings (e.g. buffers moved between memory types, shaders
+recompiled because of state) are counted, so they can be checked while
+profiling.
+
+The driver only promises to send everything if the context has debugging
+enabled; in pyglet, create it with a gl.Config that has "debug" set to True.
+"""
+
+from collections import Counter, deque
+import logging
+import re
+from threading import Lock
+from time import monotonic
+from typing import Iterable, NamedTuple, Tuple
+
+from pyglet import gl
+
+from .resources import registry
+from .util import LoggerMixin
+
+
+SOURCES = {
+    gl.GL_DEBUG_SOURCE_API: "api",
+    gl.GL_DEBUG_SOURCE_WINDOW_SYSTEM: "window_system",
+    gl.GL_DEBUG_SOURCE_SHADER_COMPILER: "shader_compiler",
+    gl.GL_DEBUG_SOURCE_THIRD_PARTY: "third_party",
+    gl.GL_DEBUG_SOURCE_APPLICATION: "application",
+    gl.GL_DEBUG_SOURCE_OTHER: "other",
+}
+
+TYPES = {
+    gl.GL_DEBUG_TYPE_ERROR: "error",
+    gl.GL_DEBUG_TYPE_DEPRECATED_BEHAVIOR: "deprecated",
+    gl.GL_DEBUG_TYPE_UNDEFINED_BEHAVIOR: "undefined",
+    gl.GL_DEBUG_TYPE_PORTABILITY: "portability",
+    gl.GL_DEBUG_TYPE_PERFORMANCE: "performance",
+    gl.GL_DEBUG_TYPE_MARKER: "marker",
+    gl.GL_DEBUG_TYPE_PUSH_GROUP: "push_group",
+    gl.GL_DEBUG_TYPE_POP_GROUP: "pop_group",
+    gl.GL_DEBUG_TYPE_OTHER: "other",
+}
+
+# Most severe first
+SEVERITIES = {
+    gl.GL_DEBUG_SEVERITY_HIGH: "high",
+    gl.GL_DEBUG_SEVERITY_MEDIUM: "medium",
+    gl.GL_DEBUG_SEVERITY_LOW: "low",
+    gl.GL_DEBUG_SEVERITY_NOTIFICATION: "notification",
+}
+
+LOG_LEVELS = {
+    "high": logging.ERROR,
+    "medium": logging.WARNING,
+    "low": logging.INFO,
+    "notification": logging.DEBUG,
+}
+
+# Registry category -> glObjectLabel identifier
+OBJECT_TYPES = {
+    "buffer": gl.GL_BUFFER,
+    "index_buffer": gl.GL_BUFFER,
+    "texture": gl.GL_TEXTURE,
+    "framebuffer": gl.GL_FRAMEBUFFER,
+    "vertex_array": gl.GL_VERTEX_ARRAY,
+    "program": gl.GL_PROGRAM,
+}
+
+# How drivers tend to mention objects in messages, e.g. "Buffer object 3"
+OBJECT_PATTERN = re.compile(r"\b(buffer|texture|framebuffer|program|vertex array)(?: object)? (\d+)",
+                            re.IGNORECASE)
+
+
+def _name(resource) -> int:
+    name = resource.name
+    return getattr(name, "value", name)
+
+
+def label(resource, text: str=None):
+    "Give a registered resource a name that shows up in debuggers and driver messages."
+    for category, identifier in OBJECT_TYPES.items():
+        if any(r is resource for r in registry.resources(category)):
+            text = (text or repr(resource)).encode()
+            gl.glObjectLabel(identifier, _name(resource), len(text), text)
+            return
+    raise ValueError(f"Can't label {resource}; it's not a registered resource.")
+
+
+def find_objects(text: str) -> Tuple[str, ...]:
+    "Descriptions of the live fogl resources mentioned in a driver message."
+    found = []
+    for kind, number in OBJECT_PATTERN.findall(text):
+        kind = kind.lower().replace(" ", "_")
+        categories = ("buffer", "index_buffer") if kind == "buffer" else (kind,)
+        for category in categories:
+            found.extend(repr(resource) for resource in registry.resources(category)
+                         if _name(resource) == int(number))
+    return tuple(found)
+
+
+# The installed DebugOutput, kept alive along with its callback until uninstalled
+_installed = None
+
+
+class Message(NamedTuple):
+
+    source: str
+    type: str
+    id: int
+    severity: str
+    text: str
+    objects: Tuple[str, ...]  # fogl resources mentioned, if any
+
+
+class DebugOutput(LoggerMixin):
+
+    """
+    Receives the debug messages of the current GL context while installed.
+
+    Only messages at least as severe as min_severity are sent by the driver.
+    sources and types (names from SOURCES and TYPES) further limit what gets
+    logged and kept. Each distinct message is logged once, and at most
+    rate_limit messages per second; everything is still counted.
+
+    With synchronous, messages are sent from the GL call that caused them, and
+    errors are logged with the stack, which is useful for finding them but slow.
+    """
+
+    def __init__(self, min_severity: str="low", sources: Iterable[str]=None,
+                 types: Iterable[str]=None, rate_limit: int=20, synchronous: bool=False,
+                 keep: int=100):
+        self.min_severity = min_severity
+        self.sources = set(sources) if sources else None
+        self.types = set(types) if types else None
+        self.rate_limit = rate_limit
+        self.synchronous = synchronous
+        self._lock = Lock()
+        self._callback = None
+        self.messages = deque(maxlen=keep)  # Distinct messages, latest last
+        self.counts = Counter()  # (source, type, id, text) -> times seen
+        self.performance = Counter()  # Text of performance warnings -> times seen
+        self.suppressed = 0  # Not logged because of the rate limit
+        self._window_start = 0
+        self._window_count = 0
+
+    def install(self):
+        global _installed
+        gl.glEnable(gl.GL_DEBUG_OUTPUT)
+        if self.synchronous:
+            gl.glEnable(gl.GL_DEBUG_OUTPUT_SYNCHRONOUS)
+        severities = list(SEVERITIES)
+        wanted = severities[:list(SEVERITIES.values()).index(self.min_severity) + 1]
+        for severity in severities:
+            gl.glDebugMessageControl(gl.GL_DONT_CARE, gl.GL_DONT_CARE, severity, 0, None,
+                                     severity in wanted)
+        # Must be kept alive as long as it's installed
+        self._callback = gl.GLDEBUGPROC(self._receive)
+        gl.glDebugMessageCallback(self._callback, None)
+        _installed = self
+
+    def uninstall(self):
+        global _installed
+        gl.glDebugMessageCallback(gl.GLDEBUGPROC(), None)
+        gl.glDisable(gl.GL_DEBUG_OUTPUT_SYNCHRONOUS)
+        gl.glDisable(gl.GL_DEBUG_OUTPUT)
+        self._callback = None
+        if _installed is self:
+            _installed = None
+
+    def _receive(self, source, type_, id_, severity, length, text, user_param):
+        source = SOURCES.get(source, "other")
+        type_ = TYPES.get(type_, "other")
+        severity = SEVERITIES.get(severity, "notification")
+        text = bytes(text[:length]).decode(errors="replace").rstrip("\n")
+        if self.sources is not None and source not in self.sources:
+            return
+        if self.types is not None and type_ not in self.types:
+            return
+        key = (source, type_, id_, text)
+        with self._lock:
+            self.counts[key] += 1
+            if type_ == "performance":
+                self.performance[text] += 1
+            if self.counts[key] > 1:
+                return
+            message = Message(source, type_, id_, severity, text, find_objects(text))
+            self.messages.append(message)
+            now = monotonic()
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            limited = self._window_count > self.rate_limit
+            if limited:
+                self.suppressed += 1
+        if not limited:
+            objects = f" ({', '.join(message.objects)})" if message.objects else ""
+            self.logger.log(LOG_LEVELS[severity], "GL %s %s %d: %s%s", source, type_, id_, text, objects,
+                            stack_info=self.synchronous and type_ == "error")
+
+    def message(self, text: str, id_: int=0, severity=gl.GL_DEBUG_SEVERITY_NOTIFICATION):
+        "Insert an application message into the debug stream, e.g. as a marker for tools."
+        data = text.encode()
+        gl.glDebugMessageInsert(gl.GL_DEBUG_SOURCE_APPLICATION, gl.GL_DEBUG_TYPE_MARKER, id_, severity,
+                                len(data), data)
+
+    def clear(self):
+        with self._lock:
+            self.messages.clear()
+            self.counts.clear()
+            self.performance.clear()
+            self.suppressed = 0
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *args):
+        self.uninstall()
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(messages={sum(self.counts.values())}, "
+                f"performance={sum(self.performance.values())}, suppressed={self.suppressed})")
@@ -0,0 +1,111 @@
+"""
+Deferred deletion of GL objects.
+
+Deleting GL objects from __del__ means driver calls at random points, whenever
+the garbage collector runs, possibly from a thread without a GL context. Instead,
+deleted objects are put in a queue which is flushed once per frame, from the GL
+thread, with one batched glDelete* call per kind of object.
+
+The queue is used once flush() has been called the first time. Before that,
+objects are deleted right away, as if there was no queue.
+"""
+
+from collections import defaultdict, deque
+
+from pyglet import gl
+
+from .resources import registry
+from .util import LoggerMixin
+
+
+def _delete_programs(count, names):
+    for name in names:
+        gl.glDeleteProgram(name)
+
+
+DELETERS = {
+    "buffer": gl.glDeleteBuffers,
+    "texture": gl.glDeleteTextures,
+    "vertex_array": gl.glDeleteVertexArrays,
+    "framebuffer": gl.glDeleteFramebuffers,
+    "query": gl.glDeleteQueries,
+    "program": _delete_programs,
+}
+
+
+class DeletionQueue(LoggerMixin):
+
+    """
+    Names of GL objects waiting to be deleted. Anything may push names, from any
+    thread; flush() must be called on the thread owning the GL context.
+
+    push() takes no lock, since it's called from __del__, which may run in the
+    middle of anything (including flush()) when the garbage collector kicks in.
+    Names are only appended to a deque, and sorted out in flush().
+
+    With grace_frames, names are kept for that many flushes before being deleted,
+    in case frames still in flight on the GPU use them.
+    """
+
+    def __init__(self, grace_frames: int=0):
+        self.grace_frames = grace_frames
+        self.enabled = False
+        self.frame = 0
+        self._incoming = deque()  # (frame, kind, name), pushed since the last flush
+        self._pending = []  # (frame, kind, name)
+        self._queued = set()  # (kind, name), against deleting twice
+        self.deleted = 0
+
+    def push(self, kind: str, name: int):
+        "Delete the named object of the given kind (see DELETERS) later."
+        if not self.enabled:
+            DELETERS[kind](1, (gl.GLuint * 1)(name))
+            self.deleted += 1
+            return
+        self._incoming.append((self.frame, kind, name))
+
+    def flush(self, everything: bool=False):
+        "Delete what's due, batched by kind. Call once per frame, e.g. after drawing."
+        self.enabled = True
+        while self._incoming:
+            entry = self._incoming.popleft()
+            if entry[1:] not in self._queued:
+                self._queued.add(entry[1:])
+                self._pending.append(entry)
+        self.frame += 1
+        limit = self.frame if everything else self.frame - self.grace_frames
+        due = [entry for entry in self._pending if entry[0] < limit]
+        if not due:
+            return
+        self._pending = [entry for entry in self._pending if entry[0] >= limit]
+        for _, kind, name in due:
+            self._queued.discard((kind, name))
+        names = defaultdict(list)
+        for _, kind, name in due:
+            names[kind].append(name)
+        for kind, kind_names in names.items():
+            DELETERS[kind](len(kind_names), (gl.GLuint * len(kind_names))(*kind_names))
+        self.deleted += len(due)
+
+    def __len__(self):
+        return len(self._pending) + len(self._incoming)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(pending={len(self)}, deleted={self.deleted})"
+
+
+# The queue used by all fogl objects.
+deletion_queue = DeletionQueue()
+
+
+def release(resource, kind: str):
+    """
+    Delete a resource's GL object, through the deletion queue, and stop tracking it.
+    Does nothing if it has already been released.
+    """
+    if getattr(resource, "_released", False):
+        return
+    resource._released = True
+    registry.remove(resource)
+    name = resource.name
+    deletion_queue.push(kind, getattr(name, "value", name))
@@ -0,0 +1,75 @@
+"""
+Transform feedback: capturing the vertices coming out of a vertex (or geometry)
+shader into a buffer, so that expensive vertex work like skinning can be done
+once and then drawn in several passes.
+"""
+
+from contextlib import contextmanager
+from ctypes import byref, c_uint, sizeof
+
+from pyglet import gl
+
+from .buffer import Buffer
+from .util import LoggerMixin
+from .vao import VertexArrayObject
+from .vertex import ObjVertices, build_structure
+
+
+class TransformFeedback(LoggerMixin):
+
+    """
+    Captures vertices into a buffer with room for max_vertices vertices of the
+    given Vertices class. The capturing Program must declare varyings matching
+    the fields of that class in order and type, e.g. for ObjVertices:
+
+        program = Program(VertexShader(...), varyings=["out_position", "out_color", "out_normal", "out_texture"])
+        with program, feedback.capture():
+            mesh.draw()
+        ...
+        feedback.draw()  # In any later pass, with another program
+
+    Captured primitives come out as separate points, lines or triangles, so draw
+    them with the matching mode.
+    """
+
+    def __init__(self, max_vertices: int, vertices_class=ObjVertices):
+        self.max_vertices = max_vertices
+        structure = build_structure(vertices_class._fields)
+        self.buffer = Buffer(size=max_vertices * sizeof(structure), structure=structure)
+        self.name = gl.GLuint()
+        gl.glCreateTransformFeedbacks(1, byref(self.name))
+        gl.glTransformFeedbackBufferBase(self.name, 0, self.buffer.name)
+        self.vao = VertexArrayObject(vertices_class=vertices_class)
+        self.vertices = vertices_class(self.vao, None, vertex_buffer=self.buffer)
+        self.primitive = gl.GL_TRIANGLES
+
+    @contextmanager
+    def capture(self, primitive=gl.GL_TRIANGLES, discard: bool=True):
+        """
+        Capture whatever is drawn inside, replacing the previous contents. The
+        primitive must match the mode of the draw calls (GL_POINTS, GL_LINES or
+        GL_TRIANGLES; strips count as their base type). With discard, nothing is
+        rasterized.
+        """
+        gl.glBindTransformFeedback(gl.GL_TRANSFORM_FEEDBACK, self.name)
+        if discard:
+            gl.glEnable(gl.GL_RASTERIZER_DISCARD)
+        gl.glBeginTransformFeedback(primitive)
+        try:
+            yield self
+        finally:
+            gl.glEndTransformFeedback()
+            if discard:
+                gl.glDisable(gl.GL_RASTERIZER_DISCARD)
+            gl.glBindTransformFeedback(gl.GL_TRANSFORM_FEEDBACK, 0)
+        self.primitive = primitive
+
+    def draw(self, mode=None):
+        "Draw the captured vertices. The number of vertices is known by GL, no need to read it back."
+        with self.vao:
+            gl.glDrawTransformFeedback(self.primitive if mode is None else mode, self.name)
+
+    def delete(self):
+        gl.glDeleteTransformFeedbacks(1, (c_uint*1)(self.name))
+        self.vertices.delete()
+        self.vao.delete()
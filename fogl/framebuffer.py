@@ -1,15 +1,27 @@
-from ctypes import byref, c_uint
+from ctypes import byref
 from pyglet import gl
-from typing import Dict, Tuple
+from typing import Dict, Iterable, Tuple
 
 from .texture import Texture, DepthTexture
 from .glutil import GLTYPE_TO_CTYPE
+from .deletion import release
+from .resources import registry
 
 
 black = (gl.GLfloat * 4)(0, 0, 0, 1)
 white = (gl.GLfloat * 4)(1, 1, 1, 1)
 
 
+# Load actions, deciding what happens to an attachment's contents when the
+# framebuffer is entered.
+CLEAR = "clear"
+KEEP = "keep"
+DONT_CARE = "dont_care"  # We'll overwrite all of it anyway, so the old contents may be thrown away
+
+# Store actions, deciding what happens to them on exit (also KEEP).
+DISCARD = "discard"  # Nobody will read the contents, e.g. a depth buffer only used for depth testing
+
+
 class FrameBuffer:
 
     """
@@ -22,15 +34,25 @@ class FrameBuffer:
     Requires a size and a mapping of names to textures. The textures will be
     the "channels" of the framebuffer. They should probably have the same size
     as the framebuffer or there will be trouble. Also they must use different
-    units.
+    units, since the unit decides the color attachment, unless "indices" maps
+    texture names to attachment indices.
+
+    A depth texture is created, unless one is given.
+
+    What happens to each texture when entering and leaving the framebuffer can be
+    controlled by "load" and "store" actions, mapping texture names to actions.
+    By default all textures are cleared on enter if autoclear is set, otherwise kept.
+    Telling GL that contents are not needed (DONT_CARE, DISCARD) can save a lot of
+    memory bandwidth on some hardware.
     """
 
     def __init__(self, size: Tuple[int, int], textures: Dict[str, Texture]={},
-                 depth_unit: int=None, autoclear: bool=False, set_viewport: bool=False):
+                 depth_unit: int=None, autoclear: bool=False, set_viewport: bool=False,
+                 depth: DepthTexture=None, load: Dict[str, str]={}, store: Dict[str, str]={},
+                 indices: Dict[str, int]=None):
 
         self.name = gl.GLuint()
         self.size = w, h = size
-        self.autoclear = autoclear
         self.set_viewport = set_viewport
 
         gl.glCreateFramebuffers(1, byref(self.name))
@@ -38,18 +60,22 @@ class FrameBuffer:
 
         # Create textures that we can use to read the results.
         self.textures = {}
+        self._color_attachments = {}
         draw_attachments = []
         max_unit = 0
         for name, texture in textures.items():
             self.textures[name] = texture
-            attachment = gl.GL_COLOR_ATTACHMENT0 + texture.unit
+            index = indices[name] if indices else texture.unit
+            self._color_attachments[name] = attachment = gl.GL_COLOR_ATTACHMENT0 + index
             gl.glFramebufferTexture(gl.GL_FRAMEBUFFER, attachment, texture.name, 0)
             draw_attachments.append(attachment)
             max_unit = max(max_unit, texture.unit)
 
         # Setup a depth buffer (presumably we always want that)
         depth_unit = depth_unit if depth_unit is not None else max_unit + 1
-        self.textures["depth"] = depth_texture = DepthTexture(self.size, unit=depth_unit)
+        if depth is None:
+            depth = DepthTexture(self.size, unit=depth_unit)
+        self.textures["depth"] = depth_texture = depth
         gl.glFramebufferTexture(gl.GL_FRAMEBUFFER, gl.GL_DEPTH_ATTACHMENT, depth_texture.name, 0)
 
         # Setup draw buffers and connect them to the textures.
@@ -62,27 +88,74 @@ class FrameBuffer:
 
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
 
+        # Index of each color texture among the draw buffers, used for clearing
+        self._draw_indices = {name: i for i, name in enumerate(textures)}
+        self.load = dict(load)
+        self.store = dict(store)
+        self.autoclear = autoclear
+        registry.add(self, "framebuffer")
+
+    @property
+    def autoclear(self):
+        return self._autoclear
+
+    @autoclear.setter
+    def autoclear(self, autoclear: bool):
+        self._autoclear = autoclear
+        self._update_actions()
+
+    def set_actions(self, load: Dict[str, str]={}, store: Dict[str, str]={}):
+        "Change the load and/or store actions for some textures."
+        self.load.update(load)
+        self.store.update(store)
+        self._update_actions()
+
+    def _attachments(self, names: Iterable[str]):
+        attachments = [gl.GL_DEPTH_ATTACHMENT if name == "depth"
+                       else self._color_attachments[name]
+                       for name in names]
+        return (gl.GLenum * len(attachments))(*attachments) if attachments else None
+
+    def _update_actions(self):
+        # Figure out up front what needs to be done on enter/exit, since it's done a lot.
+        default = CLEAR if self._autoclear else KEEP
+        load = {name: self.load.get(name, default) for name in self.textures}
+        self._clear_on_enter = [name for name, action in load.items() if action == CLEAR]
+        self._invalidate_on_enter = self._attachments(
+            name for name, action in load.items() if action == DONT_CARE)
+        self._invalidate_on_exit = self._attachments(
+            name for name in self.textures if self.store.get(name, KEEP) == DISCARD)
+
     def __enter__(self):
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.name)
-        if self.autoclear:
-            self.clear()
+        if self._invalidate_on_enter:
+            gl.glInvalidateNamedFramebufferData(self.name, len(self._invalidate_on_enter),
+                                                self._invalidate_on_enter)
+        if self._clear_on_enter:
+            self.clear(self._clear_on_enter)
         if self.set_viewport:
             gl.glViewport(0, 0, *self.size)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._invalidate_on_exit:
+            gl.glInvalidateNamedFramebufferData(self.name, len(self._invalidate_on_exit),
+                                                self._invalidate_on_exit)
         gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
 
     def __getitem__(self, texture_name: str):
         "Let textures be accessed as items, by name."
         return self.textures[texture_name]
 
-    def clear(self):
-        for index in range(len(self.textures)):
-            gl.glClearBufferfv(gl.GL_COLOR, index, black)
-        gl.glClearBufferfv(gl.GL_DEPTH, 0, white)
+    def clear(self, names: Iterable[str]=None):
+        "Clear the given textures, by default all of them."
+        for name in (self.textures if names is None else names):
+            if name == "depth":
+                gl.glClearNamedFramebufferfv(self.name, gl.GL_DEPTH, 0, white)
+            else:
+                gl.glClearNamedFramebufferfv(self.name, gl.GL_COLOR, self._draw_indices[name], black)
 
     def delete(self):
-        gl.glDeleteFramebuffers(1, (c_uint*1)(self.name))
+        release(self, "framebuffer")
         
     def read_pixel(self, name: str, x: int, y: int, gl_type=gl.GL_FLOAT, gl_format=gl.GL_RGBA):
         """
@@ -90,11 +163,12 @@ class FrameBuffer:
         under the mouse cursor.
         """
         c_type = GLTYPE_TO_CTYPE[gl_type]
-        texture = self.textures[name]
         position_value = (c_type * 4)()
-        with self:
-            gl.glReadBuffer(gl.GL_COLOR_ATTACHMENT0 + texture.unit)
-            gl.glReadPixels(x, y, 1, 1, gl_format, gl_type, byref(position_value))
+        # Not entering the framebuffer, since that may clear it.
+        gl.glNamedFramebufferReadBuffer(self.name, self._color_attachments[name])
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.name)
+        gl.glReadPixels(x, y, 1, 1, gl_format, gl_type, byref(position_value))
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, 0)
         return list(position_value)
 
     def __repr__(self):
@@ -0,0 +1,121 @@
+"""
+Rendering without a visible window, e.g. for producing images on a server.
+
+Uses pyglet's headless mode, which gets a GL context through EGL without
+needing a display. On machines without a GPU, Mesa's llvmpipe software
+renderer works (and is selected by passing software=True).
+
+Note that pyglet decides on how to create contexts when pyglet.gl is first imported,
+so this module must be imported before anything else that uses GL (including the
+rest of fogl). Alternatively, set the environment variable PYGLET_HEADLESS=1.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from ctypes import string_at
+import os
+from time import perf_counter
+from typing import Callable, Dict, Iterable, NamedTuple, Tuple
+
+import pyglet
+pyglet.options["headless"] = True
+from pyglet import gl  # noqa: E402
+
+from .buffer import BufferRing  # noqa: E402
+from .framebuffer import FrameBuffer  # noqa: E402
+from .texture import Texture  # noqa: E402
+from .util import LoggerMixin, write_png  # noqa: E402
+
+
+def create_context(size: Tuple[int, int]=(1, 1), software: bool=False, config: gl.Config=None):
+    """
+    Create an invisible window, with a GL context that can be used for rendering
+    to framebuffers. Returns the window; keep it around as long as the context is needed.
+    """
+    if software:
+        os.environ.setdefault("LIBGL_ALWAYS_SOFTWARE", "1")
+        os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+    if config is None:
+        config = gl.Config(major_version=4, minor_version=5, double_buffer=False)
+    window = pyglet.window.Window(*size, visible=False, config=config)
+    window.switch_to()
+    return window
+
+
+class Job(NamedTuple):
+
+    # Called with the framebuffer active; should draw the scene as seen from some camera.
+    render: Callable[[FrameBuffer], None]
+    filename: str
+
+
+class BatchStats(NamedTuple):
+
+    images: int
+    seconds: float
+
+    @property
+    def images_per_second(self):
+        return self.images / self.seconds if self.seconds else 0
+
+
+class BatchRenderer(LoggerMixin):
+
+    """
+    Renders a bunch of jobs back to back into an offscreen framebuffer, and saves
+    the resulting images. Reading back the pixels is pipelined through a ring of
+    pixel pack buffers so that we don't wait for each image to finish before
+    starting the next one, and PNG encoding runs in a pool of processes.
+
+    Extra textures (besides "color", which is the one saved) can be given, in
+    case the rendering needs them.
+    """
+
+    def __init__(self, size: Tuple[int, int], textures: Dict[str, Texture]=None,
+                 in_flight: int=3, processes: int=None):
+        self.size = w, h = size
+        textures = dict(textures or {})
+        textures.setdefault("color", Texture(size, unit=0))
+        self.framebuffer = FrameBuffer(size, textures, autoclear=True, set_viewport=True)
+        self.ring = BufferRing(4 * w * h, in_flight, access=gl.GL_MAP_READ_BIT)
+        self.executor = ProcessPoolExecutor(processes)
+
+    def _read(self):
+        buffer_name, _ = self.ring.acquire()
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buffer_name)
+        gl.glGetTextureImage(self.framebuffer["color"].name, 0, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE,
+                             self.ring.size, None)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        index = self.ring.index
+        self.ring.release()
+        return index
+
+    def _save(self, index, filename):
+        self.ring.wait(index)
+        data = string_at(self.ring.addresses[index], self.ring.size)
+        return self.executor.submit(write_png, filename, self.size, data)
+
+    def render(self, jobs: Iterable[Job]) -> BatchStats:
+        "Render and save all the jobs. Returns once all images are written."
+        start = perf_counter()
+        pending = deque()
+        futures = []
+        for job in jobs:
+            with self.framebuffer:
+                job.render(self.framebuffer)
+            if len(pending) == self.ring.count:
+                futures.append(self._save(*pending.popleft()))
+            pending.append((self._read(), job.filename))
+        while pending:
+            futures.append(self._save(*pending.popleft()))
+        for future in futures:
+            future.result()  # Raises any errors from encoding
+        stats = BatchStats(len(futures), perf_counter() - start)
+        self.logger.info("Rendered %d images in %.2f s (%.1f images/s)",
+                         stats.images, stats.seconds, stats.images_per_second)
+        return stats
+
+    def delete(self):
+        self.executor.shutdown()
+        self.ring.delete()
+        self.framebuffer.delete()
@@ -3,13 +3,15 @@ Tweaked version of the imgui pyglet integration, to use pyglet's gl wrapper
 instead of PyOpenGL's. Hopefully won't be needed forever.
 """
 
-from ctypes import byref, create_string_buffer, cast, pointer, POINTER, c_char, c_void_p, c_int, c_uint
+from ctypes import byref, create_string_buffer, cast, pointer, POINTER, c_char, c_void_p, c_int, c_uint, memmove
 
 from pyglet.window import key, mouse
 from pyglet import gl
 
 import imgui
 
+from .buffer import BufferRing
+
 
 class BaseOpenGLRenderer(object):
     def __init__(self):
@@ -333,6 +335,148 @@ class ProgrammablePipelineRenderer(BaseOpenGLRenderer):
         self._font_texture = 0
 
 
+class PersistentPipelineRenderer(ProgrammablePipelineRenderer):
+
+    """
+    Faster version of the renderer. All command lists are copied into one pair of
+    persistently mapped buffers per frame (from a ring, so that we don't wait
+    for the GPU) and drawn with glDrawElementsBaseVertex. Texture and scissor
+    changes are only made when needed.
+
+    Instead of querying the driver for the state to restore, which is slow, we
+    assume that the rest of the application leaves the capabilities in
+    "app_state" (by default GL's initial state) and that it does not rely on the
+    program, vertex array or texture bindings (the fogl objects all unbind on
+    exit). Only what's changed is put back. The blend function and viewport are
+    left as the UI needs them.
+    """
+
+    # Capabilities the UI needs, enabled or not
+    UI_STATE = {
+        gl.GL_BLEND: True,
+        gl.GL_CULL_FACE: False,
+        gl.GL_DEPTH_TEST: False,
+        gl.GL_SCISSOR_TEST: True,
+    }
+
+    buffer_count = 3  # Frames in flight
+
+    def __init__(self, app_state=None):
+        self.app_state = {capability: False for capability in self.UI_STATE}
+        self.app_state.update(app_state or {})
+        self._vertex_ring = self._index_ring = None
+        super().__init__()
+
+    def _create_device_objects(self):
+        super()._create_device_objects()
+        # Use a single binding point, so that the buffer can be switched each frame
+        offsets = [(self._attrib_location_position, 2, gl.GL_FLOAT, gl.GL_FALSE, imgui.VERTEX_BUFFER_POS_OFFSET),
+                   (self._attrib_location_uv, 2, gl.GL_FLOAT, gl.GL_FALSE, imgui.VERTEX_BUFFER_UV_OFFSET),
+                   (self._attrib_location_color, 4, gl.GL_UNSIGNED_BYTE, gl.GL_TRUE, imgui.VERTEX_BUFFER_COL_OFFSET)]
+        for location, size, type_, normalized, offset in offsets:
+            gl.glVertexArrayAttribFormat(self._vao_handle, location, size, type_, normalized, offset)
+            gl.glVertexArrayAttribBinding(self._vao_handle, location, 0)
+
+    def _get_rings(self, vertex_size, index_size):
+        "Buffer rings big enough for the frame; they grow as needed."
+        if self._vertex_ring is None or self._vertex_ring.size < vertex_size:
+            if self._vertex_ring:
+                self._vertex_ring.delete()
+            self._vertex_ring = BufferRing(max(2 * vertex_size, 1 << 16), self.buffer_count)
+        if self._index_ring is None or self._index_ring.size < index_size:
+            if self._index_ring:
+                self._index_ring.delete()
+            self._index_ring = BufferRing(max(2 * index_size, 1 << 16), self.buffer_count)
+        return self._vertex_ring, self._index_ring
+
+    def render(self, draw_data):
+        io = self.io
+
+        display_width, display_height = io.display_size
+        fb_width = int(display_width * io.display_fb_scale[0])
+        fb_height = int(display_height * io.display_fb_scale[1])
+
+        if fb_width == 0 or fb_height == 0:
+            return
+
+        draw_data.scale_clip_rects(*io.display_fb_scale)
+
+        # Upload everything at once
+        command_lists = draw_data.commands_lists
+        vertex_size = sum(commands.vtx_buffer_size for commands in command_lists) * imgui.VERTEX_SIZE
+        index_size = sum(commands.idx_buffer_size for commands in command_lists) * imgui.INDEX_SIZE
+        if not index_size:
+            return
+        vertex_ring, index_ring = self._get_rings(vertex_size, index_size)
+        vertex_buffer, vertex_address = vertex_ring.acquire()
+        index_buffer, index_address = index_ring.acquire()
+        draws = []
+        vertex_offset = index_offset = 0  # In vertices and bytes
+        for commands in command_lists:
+            n_vertices = commands.vtx_buffer_size
+            memmove(vertex_address + vertex_offset * imgui.VERTEX_SIZE, commands.vtx_buffer_data,
+                    n_vertices * imgui.VERTEX_SIZE)
+            memmove(index_address + index_offset, commands.idx_buffer_data,
+                    commands.idx_buffer_size * imgui.INDEX_SIZE)
+            for command in commands.commands:
+                draws.append((command.texture_id, tuple(command.clip_rect), command.elem_count,
+                              index_offset, vertex_offset))
+                index_offset += command.elem_count * imgui.INDEX_SIZE
+            vertex_offset += n_vertices
+
+        # Set up
+        for capability, enabled in self.UI_STATE.items():
+            if self.app_state[capability] != enabled:
+                (gl.glEnable if enabled else gl.glDisable)(capability)
+        gl.glBlendEquation(gl.GL_FUNC_ADD)
+        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        gl.glViewport(0, 0, fb_width, fb_height)
+
+        ortho_projection = [
+            2.0/display_width, 0.0,                   0.0, 0.0,
+            0.0,               2.0/-display_height,   0.0, 0.0,
+            0.0,               0.0,                  -1.0, 0.0,
+            -1.0,               1.0,                   0.0, 1.0
+        ]
+        gl.glUseProgram(self._shader_handle)
+        gl.glUniform1i(self._attrib_location_tex, 0)
+        gl.glUniformMatrix4fv(self._attrib_proj_mtx, 1, gl.GL_FALSE, (gl.GLfloat * 16)(*ortho_projection))
+        gl.glVertexArrayVertexBuffer(self._vao_handle, 0, vertex_buffer, 0, imgui.VERTEX_SIZE)
+        gl.glVertexArrayElementBuffer(self._vao_handle, index_buffer)
+        gl.glBindVertexArray(self._vao_handle)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+
+        index_type = gl.GL_UNSIGNED_SHORT if imgui.INDEX_SIZE == 2 else gl.GL_UNSIGNED_INT
+        current_texture = current_scissor = None
+        for texture_id, (x, y, z, w), count, offset, base_vertex in draws:
+            if texture_id != current_texture:
+                gl.glBindTexture(gl.GL_TEXTURE_2D, texture_id)
+                current_texture = texture_id
+            scissor = int(x), int(fb_height - w), int(z - x), int(w - y)
+            if scissor != current_scissor:
+                gl.glScissor(*scissor)
+                current_scissor = scissor
+            gl.glDrawElementsBaseVertex(gl.GL_TRIANGLES, count, index_type, c_void_p(offset), base_vertex)
+
+        vertex_ring.release()
+        index_ring.release()
+
+        # Put back what we changed
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        gl.glBindVertexArray(0)
+        gl.glUseProgram(0)
+        for capability, enabled in self.UI_STATE.items():
+            if self.app_state[capability] != enabled:
+                (gl.glDisable if enabled else gl.glEnable)(capability)
+
+    def _invalidate_device_objects(self):
+        for ring in (self._vertex_ring, self._index_ring):
+            if ring:
+                ring.delete()
+        self._vertex_ring = self._index_ring = None
+        super()._invalidate_device_objects()
+
+
 class PygletMixin(object):
     REVERSE_KEY_MAP = {
         key.TAB: imgui.KEY_TAB,
@@ -430,8 +574,11 @@ class PygletMixin(object):
 
 
 class PygletRenderer(PygletMixin, ProgrammablePipelineRenderer):
-    def __init__(self, window, attach_callbacks=True):
-        super(PygletRenderer, self).__init__()
+    def __init__(self, window, attach_callbacks=True, **kwargs):
+        super(PygletRenderer, self).__init__(**kwargs)
+        self._attach(window, attach_callbacks)
+
+    def _attach(self, window, attach_callbacks):
         self.io.display_size = window.width, window.height
         self._map_keys()
 
@@ -445,3 +592,14 @@ class PygletRenderer(PygletMixin, ProgrammablePipelineRenderer):
                                  self.on_mouse_release,
                                  self.on_mouse_scroll,
                                  self.on_resize)
+
+
+class FastPygletRenderer(PygletMixin, PersistentPipelineRenderer):
+
+    "Pyglet integration using the faster renderer; see PersistentPipelineRenderer."
+
+    def __init__(self, window, attach_callbacks=True, **kwargs):
+        super().__init__(**kwargs)
+        self._attach(window, attach_callbacks)
+
+    _attach = PygletRenderer._attach
@@ -0,0 +1,175 @@
+"""
+Counting GL calls, for catching things like redundant binds or accidental
+re-uploads. While a CallCounter is installed, every GL function in pyglet.gl
+is replaced with a wrapper that counts calls. Uninstalled, the original
+functions are put back, so there is no cost when not counting.
+
+    with counting() as counter:
+        scene.draw()
+    assert counter.draw_calls <= 10
+
+Only code that looks the functions up at call time (gl.glSomething, as fogl
+does) is counted.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from ctypes import c_void_p
+import importlib
+from typing import NamedTuple
+
+from pyglet import gl
+
+from .util import LoggerMixin
+
+
+STATE_PREFIXES = ("glBind", "glUseProgram", "glEnable", "glDisable", "glViewport", "glScissor",
+                  "glBlend", "glDepthFunc", "glDepthMask", "glCullFace", "glColorMask",
+                  "glPolygonMode", "glClearColor", "glActiveTexture", "glPixelStore")
+
+DRAW_PREFIXES = ("glDraw", "glMultiDraw")
+
+COMPONENTS = {
+    gl.GL_RED: 1, gl.GL_RED_INTEGER: 1, gl.GL_DEPTH_COMPONENT: 1,
+    gl.GL_RG: 2, gl.GL_RG_INTEGER: 2,
+    gl.GL_RGB: 3, gl.GL_BGR: 3, gl.GL_RGB_INTEGER: 3,
+    gl.GL_RGBA: 4, gl.GL_BGRA: 4, gl.GL_RGBA_INTEGER: 4,
+}
+
+TYPE_SIZES = {
+    gl.GL_BYTE: 1, gl.GL_UNSIGNED_BYTE: 1,
+    gl.GL_SHORT: 2, gl.GL_UNSIGNED_SHORT: 2, gl.GL_HALF_FLOAT: 2,
+    gl.GL_INT: 4, gl.GL_UNSIGNED_INT: 4, gl.GL_FLOAT: 4,
+}
+
+
+def _texture_bytes(width, height, depth, gl_format, gl_type):
+    return width * height * depth * COMPONENTS.get(gl_format, 4) * TYPE_SIZES.get(gl_type, 1)
+
+
+def _has_data(pointer) -> bool:
+    "False for a NULL data pointer, which means allocating storage without uploading."
+    if isinstance(pointer, c_void_p):
+        pointer = pointer.value
+    return not (pointer is None or isinstance(pointer, int) and pointer == 0)
+
+
+# How many bytes each upload function sends, from its arguments. Allocations
+# with NULL data only count when given data.
+UPLOADS = {
+    "glNamedBufferStorage": lambda args: args[1] if _has_data(args[2]) else 0,
+    "glNamedBufferData": lambda args: args[1] if _has_data(args[2]) else 0,
+    "glNamedBufferSubData": lambda args: args[2],
+    "glBufferStorage": lambda args: args[1] if _has_data(args[2]) else 0,
+    "glBufferData": lambda args: args[1] if _has_data(args[2]) else 0,
+    "glBufferSubData": lambda args: args[2],
+    "glTexImage2D": lambda args: (_texture_bytes(args[3], args[4], 1, args[6], args[7])
+                                  if _has_data(args[8]) else 0),
+    "glTextureSubImage2D": lambda args: _texture_bytes(args[4], args[5], 1, args[6], args[7]),
+    "glTextureSubImage3D": lambda args: _texture_bytes(args[5], args[6], args[7], args[8], args[9]),
+}
+
+
+class FrameStats(NamedTuple):
+
+    calls: Counter  # Function name -> number of calls
+    draw_calls: int
+    state_changes: int
+    upload_bytes: int
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+class CallCounter(LoggerMixin):
+
+    """
+    Counts GL calls while installed. The counts since the last end_frame()
+    are available as attributes; end_frame() returns them as FrameStats and
+    starts over. Only one counter can be installed at a time.
+    """
+
+    _installed = None
+
+    def __init__(self):
+        self._originals = {}
+        self.frames = 0
+        self.last_frame = None
+        self.reset()
+
+    def reset(self):
+        self.calls = Counter()
+        self.draw_calls = 0
+        self.state_changes = 0
+        self.upload_bytes = 0
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _wrap(self, name, function):
+        is_draw = name.startswith(DRAW_PREFIXES)
+        is_state = name.startswith(STATE_PREFIXES)
+        upload = UPLOADS.get(name)
+
+        def counted(*args):
+            self.calls[name] += 1
+            if is_draw:
+                self.draw_calls += 1
+            elif is_state:
+                self.state_changes += 1
+            elif upload:
+                size = upload(args)
+                self.upload_bytes += getattr(size, "value", size)
+            return function(*args)
+
+        counted.__name__ = name
+        return counted
+
+    def install(self):
+        "Start counting, by wrapping the functions of pyglet.gl."
+        if CallCounter._installed is not None:
+            raise RuntimeError("A CallCounter is already installed.")
+        module = importlib.import_module("pyglet.gl")
+        for name, function in vars(module).items():
+            # pyglet checks glGetError after every call, unless debug_gl is off
+            if name.startswith("gl") and callable(function) and name != "glGetError":
+                self._originals[name] = function
+        for name, function in self._originals.items():
+            setattr(module, name, self._wrap(name, function))
+        CallCounter._installed = self
+
+    def uninstall(self):
+        "Stop counting and put back the original functions."
+        module = importlib.import_module("pyglet.gl")
+        for name, function in self._originals.items():
+            setattr(module, name, function)
+        self._originals = {}
+        if CallCounter._installed is self:
+            CallCounter._installed = None
+
+    def end_frame(self) -> FrameStats:
+        "Return the counts for the frame, and start counting the next."
+        self.last_frame = FrameStats(self.calls, self.draw_calls, self.state_changes, self.upload_bytes)
+        self.frames += 1
+        self.reset()
+        return self.last_frame
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *args):
+        self.uninstall()
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(calls={self.total_calls}, draw_calls={self.draw_calls}, "
+                f"state_changes={self.state_changes}, upload_bytes={self.upload_bytes})")
+
+
+@contextmanager
+def counting():
+    "Count the GL calls made inside."
+    with CallCounter() as counter:
+        yield counter
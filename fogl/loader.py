@@ -0,0 +1,199 @@
+"""
+Loading assets without stopping the frame.
+
+Reading and parsing files happens on a pool of worker threads. The GL part
+(creating buffers and textures, uploading data) must happen on the thread
+owning the context, so it's put in an UploadQueue, which the render loop
+drains every frame for at most a given number of milliseconds. Big uploads
+are split into chunks, so that they can be spread over several frames.
+
+    loader = AssetLoader()
+    future = loader.load_obj("suzanne.obj")
+    ...
+    # every frame
+    loader.uploads.drain(budget_ms=2)
+    if future.done():
+        mesh = future.result()
+
+Done callbacks on the futures are run by drain(), so they may use GL.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from ctypes import addressof, sizeof
+from threading import Lock
+from time import perf_counter
+from types import GeneratorType
+from typing import Callable, Generator
+
+from pyglet import gl
+
+from .buffer import Buffer
+from .mesh import Mesh
+from .obj import parse_obj_file
+from .texture import ImageTexture, Texture
+from .util import LoggerMixin, load_png
+from .vertex import ObjVertices, build_structure
+
+
+class UploadQueue(LoggerMixin):
+
+    """
+    GL work waiting to be done on the GL thread. Tasks can be added from any
+    thread. A task is a function, or a generator that does part of the work
+    each time it's advanced; what it returns becomes the result of its future.
+    Cancelling the future before the task has started skips it.
+
+    This is for use from other threads; pyglet.clock (and so util.immediately)
+    is not thread safe.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._tasks = deque()
+
+    def submit(self, task, future: Future=None) -> Future:
+        "Queue a function or generator. Returns a future for its result."
+        future = future or Future()
+        with self._lock:
+            self._tasks.append((task, future))
+        return future
+
+    def drain(self, budget_ms: float=2.0) -> int:
+        """
+        Do queued work until the time budget is spent, or there's nothing left.
+        At least one step is done. Call once per frame, from the GL thread.
+        Returns the number of tasks finished.
+        """
+        deadline = perf_counter() + budget_ms / 1000
+        finished = 0
+        while True:
+            with self._lock:
+                if not self._tasks:
+                    break
+                task, future = self._tasks[0]
+            if not future.running() and not future.set_running_or_notify_cancel():
+                # Cancelled while waiting
+                with self._lock:
+                    self._tasks.popleft()
+                if isinstance(task, GeneratorType):
+                    task.close()
+                continue
+            if self._step(task, future):
+                with self._lock:
+                    self._tasks.popleft()
+                finished += 1
+            if perf_counter() >= deadline:
+                break
+        return finished
+
+    def _step(self, task, future) -> bool:
+        "Do a step of the task; returns whether it's done."
+        try:
+            if isinstance(task, GeneratorType):
+                try:
+                    next(task)
+                    return False
+                except StopIteration as stop:
+                    result = stop.value
+            else:
+                result = task()
+        except Exception as e:
+            self.logger.exception("Upload failed")
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tasks)
+
+
+def upload_buffer(data, structure, chunk_size: int) -> Generator:
+    "Create a buffer and upload a ctypes array to it, chunk by chunk. Returns the buffer."
+    size = sizeof(data)
+    buffer = Buffer(structure=structure, size=size)
+    address = addressof(data)
+    for offset in range(0, size, chunk_size):
+        gl.glNamedBufferSubData(buffer.name, offset, min(chunk_size, size - offset), address + offset)
+        yield
+    return buffer
+
+
+class AssetLoader(LoggerMixin):
+
+    """
+    Loads meshes and textures in the background. Results are futures, that are
+    done once the GL objects are ready. chunk_size (in bytes) is roughly how much
+    is uploaded in one step.
+    """
+
+    def __init__(self, max_workers: int=None, uploads: UploadQueue=None, chunk_size: int=1 << 20):
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="fogl-loader")
+        self.uploads = uploads or UploadQueue()
+        self.chunk_size = chunk_size
+
+    def load(self, read: Callable, upload: Callable[..., Generator]) -> Future:
+        """
+        Run read() on a worker thread, then queue upload(result) for the GL thread.
+        upload must be a generator function, yielding between chunks of work.
+        Returns a future for what upload returns.
+        """
+        result = Future()
+
+        def queue_upload(read_future):
+            if result.cancelled():
+                return
+            try:
+                data = read_future.result()
+            except Exception as e:
+                self.logger.exception("Loading failed")
+                if result.set_running_or_notify_cancel():
+                    result.set_exception(e)
+            else:
+                self.uploads.submit(upload(data), result)
+
+        self.executor.submit(read).add_done_callback(queue_upload)
+        return result
+
+    def load_obj(self, path: str, texture: Texture=None, optimize: bool=False) -> Future:
+        "Load an OBJ file (and its materials) into a Mesh. See ObjMesh."
+
+        def read():
+            with open(path) as f:
+                data = parse_obj_file(f)
+            indices = None
+            if optimize:
+                from .meshopt import optimize_mesh
+                data, indices, _, _ = optimize_mesh(data)
+            structure = build_structure(ObjVertices._fields)
+            return data, indices, (structure * len(data))(*data)
+
+        def upload(loaded):
+            data, indices, array = loaded
+            buffer = yield from upload_buffer(array, type(array)._type_, self.chunk_size)
+            return Mesh(data, texture, vertices_class=ObjVertices, indices=indices, vertex_buffer=buffer)
+
+        return self.load(read, upload)
+
+    def load_texture(self, path: str, unit: int=0) -> Future:
+        "Load a png file into an ImageTexture."
+
+        def read():
+            size, image = load_png(path)
+            return size, bytes(image)
+
+        def upload(loaded):
+            (w, h), image = loaded
+            texture = ImageTexture((w, h), image, unit, upload=False)
+            rows = max(1, self.chunk_size // (4 * w))
+            for first_row in range(0, h, rows):
+                yield
+                texture.upload(first_row, min(rows, h - first_row))
+            return texture
+
+        return self.load(read, upload)
+
+    def shutdown(self):
+        self.executor.shutdown()
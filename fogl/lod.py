@@ -0,0 +1,282 @@
+"""
+Level of detail (LOD): simplified versions of meshes, for drawing things that
+are far away.
+
+The simplification is based on quadric error metrics (Garland & Heckbert).
+Instead of collapsing one edge at a time, each pass picks a large set of cheap
+edges that don't share vertices and collapses them all at once, with numpy.
+Collapses always move a vertex onto a neighbour, so every level is just a new
+index buffer into the original vertices.
+"""
+
+from hashlib import sha1
+from math import sqrt
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from pyglet import gl
+
+from .buffer import IndexBuffer
+from .util import LoggerMixin
+
+
+def weld(positions) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merge vertices with identical positions. Returns the unique positions, the index
+    of each original vertex among those, and an original vertex for each unique one.
+    """
+    positions = np.ascontiguousarray(positions, dtype=np.float32).reshape(-1, 3)
+    keys = positions.view(np.dtype((np.void, 12))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return positions[first].astype(np.float64), inverse.ravel(), first
+
+
+def _plane_quadrics(normals, d, weights):
+    "Quadrics, as the 10 unique entries of the symmetric 4x4 matrix, for the given planes."
+    a, b, c = normals[:, 0], normals[:, 1], normals[:, 2]
+    return weights[:, None] * np.stack([a * a, a * b, a * c, a * d, b * b, b * c, b * d,
+                                        c * c, c * d, d * d], axis=1)
+
+
+def _quadric_error(q, p):
+    "Evaluate the quadrics q (n, 10) at the points p (n, 3)."
+    x, y, z = p[:, 0], p[:, 1], p[:, 2]
+    return (q[:, 0] * x * x + 2 * q[:, 1] * x * y + 2 * q[:, 2] * x * z + 2 * q[:, 3] * x
+            + q[:, 4] * y * y + 2 * q[:, 5] * y * z + 2 * q[:, 6] * y
+            + q[:, 7] * z * z + 2 * q[:, 8] * z + q[:, 9])
+
+
+def _face_normals(positions, triangles):
+    p0, p1, p2 = (positions[triangles[:, i]] for i in range(3))
+    return np.cross(p1 - p0, p2 - p0)
+
+
+def _vertex_quadrics(positions, triangles, boundary_weight):
+    n_vertices = len(positions)
+    normals = _face_normals(positions, triangles)
+    area = np.linalg.norm(normals, axis=1)
+    unit = normals / np.maximum(area, 1e-30)[:, None]
+    d = -(unit * positions[triangles[:, 0]]).sum(axis=1)
+    face_q = _plane_quadrics(unit, d, area / 2)
+    q = np.zeros((n_vertices, 10))
+    for corner in range(3):
+        for i in range(10):
+            q[:, i] += np.bincount(triangles[:, corner], weights=face_q[:, i], minlength=n_vertices)
+
+    # Keep the outline of open meshes in place, by adding planes perpendicular
+    # to the faces along edges that only belong to one face.
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    faces = np.tile(np.arange(len(triangles)), 3)
+    keys = np.sort(edges, axis=1)
+    keys = keys[:, 0] * n_vertices + keys[:, 1]
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    boundary = counts[inverse.ravel()] == 1
+    if boundary.any():
+        a, b = edges[boundary, 0], edges[boundary, 1]
+        direction = positions[b] - positions[a]
+        length = np.linalg.norm(direction, axis=1)
+        normal = np.cross(direction, unit[faces[boundary]])
+        normal /= np.maximum(np.linalg.norm(normal, axis=1), 1e-30)[:, None]
+        d = -(normal * positions[a]).sum(axis=1)
+        edge_q = _plane_quadrics(normal, d, boundary_weight * length ** 2)
+        for vertices in (a, b):
+            for i in range(10):
+                q[:, i] += np.bincount(vertices, weights=edge_q[:, i], minlength=n_vertices)
+    return q
+
+
+def simplify(positions, triangles, target: int, boundary_weight: float=10.0,
+             collapse_fraction: float=0.5, matching_rounds: int=4,
+             max_passes: int=100) -> np.ndarray:
+    """
+    Reduce the triangles (indices into positions, shape (n, 3)) to about "target"
+    triangles. Returns the new triangles, using a subset of the same vertices.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+    n_vertices = len(positions)
+    q = _vertex_quadrics(positions, triangles, boundary_weight)
+
+    for _ in range(max_passes):
+        if len(triangles) <= target:
+            break
+        edges = np.sort(np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]]), axis=1)
+        edges = np.sort(edges[:, 0] * n_vertices + edges[:, 1])
+        edges = edges[np.concatenate([[True], edges[1:] != edges[:-1]])]
+        a, b = edges // n_vertices, edges % n_vertices
+
+        # Cost of moving a onto b, and the other way around; pick the cheaper
+        q_sum = q[a] + q[b]
+        cost_ab = _quadric_error(q_sum, positions[b])
+        cost_ba = _quadric_error(q_sum, positions[a])
+        flip = cost_ba < cost_ab
+        source = np.where(flip, b, a)
+        destination = np.where(flip, a, b)
+        cost = np.minimum(cost_ab, cost_ba)
+
+        # Only collapse edges that are the cheapest at both of their vertices,
+        # so that no vertex is involved in more than one collapse. Repeat among
+        # the edges whose vertices are still free, to find more of them.
+        order = np.argsort(cost, kind="stable")
+        used = np.zeros(n_vertices, dtype=bool)
+        chosen = []
+        for _ in range(matching_rounds):
+            order = order[~(used[a[order]] | used[b[order]])]
+            if not len(order):
+                break
+            # Assigning in reverse order, the cheapest edge is written last
+            reverse = order[::-1]
+            best = np.full(n_vertices, -1)
+            best[np.stack([a[reverse], b[reverse]], axis=1).ravel()] = np.repeat(reverse, 2)
+            found = order[(best[a[order]] == order) & (best[b[order]] == order)]
+            used[a[found]] = used[b[found]] = True
+            chosen.append(found)
+        selected = np.concatenate(chosen) if chosen else np.zeros(0, dtype=np.int64)
+        selected = selected[np.argsort(cost[selected], kind="stable")]
+        # Each collapse removes about two triangles
+        n_collapses = min(max(1, int(len(selected) * collapse_fraction)),
+                          max(1, (len(triangles) - target) // 2))
+        selected = selected[:n_collapses]
+
+        # Don't collapse edges that would flip triangles over
+        remap = np.arange(n_vertices)
+        remap[source[selected]] = destination[selected]
+        collapse_of = np.full(n_vertices, -1)
+        collapse_of[source[selected]] = np.arange(len(selected))
+        new_triangles = remap[triangles]
+        moved = (collapse_of[triangles] >= 0).any(axis=1)
+        old_normals = _face_normals(positions, triangles[moved])
+        new_normals = _face_normals(positions, new_triangles[moved])
+        flipped = (old_normals * new_normals).sum(axis=1) < 0
+        bad = np.zeros(len(selected), dtype=bool)
+        which = collapse_of[triangles[moved]]
+        for corner in range(3):
+            hit = flipped & (which[:, corner] >= 0)
+            bad[which[hit, corner]] = True
+        selected = selected[~bad]
+        if not len(selected):
+            break
+
+        remap = np.arange(n_vertices)
+        remap[source[selected]] = destination[selected]
+        np.add.at(q, destination[selected], q[source[selected]])
+        triangles = remap[triangles]
+        degenerate = ((triangles[:, 0] == triangles[:, 1]) | (triangles[:, 1] == triangles[:, 2])
+                      | (triangles[:, 2] == triangles[:, 0]))
+        triangles = triangles[~degenerate]
+    return triangles
+
+
+def build_lods(positions, triangles, ratios: Sequence[float]=(0.5, 0.25, 0.125),
+               cache_dir: str=None, **kwargs) -> List[np.ndarray]:
+    """
+    Make a chain of simplified versions of the triangles (indices into positions),
+    each with the given fraction of the original triangle count. Each level is
+    simplified from the previous one.
+
+    Positions with identical coordinates are treated as one vertex. Returned
+    triangles refer to the original positions.
+
+    If cache_dir is given, results are stored there and reused.
+    """
+    positions = np.ascontiguousarray(positions, dtype=np.float32).reshape(-1, 3)
+    triangles = np.ascontiguousarray(triangles, dtype=np.int64).reshape(-1, 3)
+    if cache_dir:
+        # Simplification options change the result too
+        options = repr((tuple(ratios), sorted(kwargs.items())))
+        key = sha1(positions.tobytes() + triangles.tobytes() + options.encode()).hexdigest()
+        cache_file = os.path.join(cache_dir, f"lods-{key}.npz")
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                return [cached[f"level{i}"] for i in range(len(ratios))]
+
+    unique, inverse, original = weld(positions)
+    welded = inverse[triangles]
+    levels = []
+    for ratio in ratios:
+        welded = simplify(unique, welded, int(len(triangles) * ratio), **kwargs)
+        levels.append(original[welded])
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_file, **{f"level{i}": level for i, level in enumerate(levels)})
+    return levels
+
+
+def screen_size(bounding_sphere, model_view: Sequence[float], projection: Sequence[float]) -> float:
+    """
+    Rough size of a bounding sphere on screen, as a fraction of the screen height,
+    given model-view and (perspective) projection matrices in GL order.
+    """
+    (x, y, z), radius = bounding_sphere
+    m = list(model_view)
+    # Depth of the center in view space
+    depth = -(m[2] * x + m[6] * y + m[10] * z + m[14])
+    scale = max(sqrt(m[0]**2 + m[1]**2 + m[2]**2),
+                sqrt(m[4]**2 + m[5]**2 + m[6]**2),
+                sqrt(m[8]**2 + m[9]**2 + m[10]**2))
+    if depth <= radius * scale:
+        return float("inf")  # We're inside it, more or less
+    return radius * scale * list(projection)[5] / depth
+
+
+class LodChain(LoggerMixin):
+
+    """
+    Index buffers for a mesh's levels of detail, and the logic for picking one.
+
+    Level 0 is the full mesh. Level i is used when the mesh's screen size (see
+    screen_size()) is below thresholds[i]. To prevent flickering back and forth,
+    the size has to get past the threshold by a margin ("hysteresis", as a fraction
+    of the threshold) before switching.
+    """
+
+    def __init__(self, index_buffers: Sequence[IndexBuffer], thresholds: Sequence[float],
+                 hysteresis: float=0.1):
+        if len(index_buffers) != len(thresholds):
+            raise ValueError("Need one threshold per level of detail.")
+        self.index_buffers = [None, *index_buffers]  # None means the mesh's own indices
+        self.thresholds = [float("inf"), *thresholds]
+        self.hysteresis = hysteresis
+        self._levels = {}
+
+    def __len__(self):
+        return len(self.index_buffers)
+
+    def select_level(self, size: float, key=None) -> int:
+        "Pick level for the given screen size. Key identifies the object, if several share the chain."
+        level = self._levels.get(key, 0)
+        while level + 1 < len(self.thresholds) and size < self.thresholds[level + 1] * (1 - self.hysteresis):
+            level += 1
+        while level > 0 and size > self.thresholds[level] * (1 + self.hysteresis):
+            level -= 1
+        self._levels[key] = level
+        return level
+
+    def select(self, size: float, key=None) -> IndexBuffer:
+        "Return the index buffer to use, or None for the full mesh."
+        return self.index_buffers[self.select_level(size, key)]
+
+    def delete(self):
+        for index_buffer in self.index_buffers[1:]:
+            index_buffer.delete()
+
+
+def make_lod_chain(mesh, ratios: Sequence[float]=(0.5, 0.25, 0.125), thresholds: Sequence[float]=None,
+                   full_detail_size: float=0.5, mode=None, cache_dir: str=None,
+                   **kwargs) -> LodChain:
+    """
+    Build levels of detail for a Mesh. By default, a level with ratio r is used below
+    a screen size of full_detail_size * sqrt(r), keeping the triangle density on screen
+    about the same.
+    """
+    from .bvh import triangles_from_mode
+    positions = np.array([vertex[0] for vertex in mesh.data], dtype=np.float32)
+    triangles = triangles_from_mode(len(positions), mesh.mode if mode is None else mode, mesh.indices)
+    levels = build_lods(positions, triangles, ratios, cache_dir, **kwargs)
+    if thresholds is None:
+        thresholds = [full_detail_size * sqrt(ratio) for ratio in ratios]
+    with mesh.vao:
+        index_buffers = [IndexBuffer(level.ravel().tolist()) for level in levels]
+    return LodChain(index_buffers, thresholds)
@@ -7,6 +7,7 @@ from typing import List
 
 from pyglet import gl
 
+from .buffer import Buffer
 from .obj import parse_obj_file
 from .texture import Texture
 from .vao import VertexArrayObject
@@ -19,11 +20,23 @@ class Mesh:
     A mesh is just a convenience for drawing vertices.
     """
 
-    def __init__(self, data: List, texture: Texture=None, vertices_class=ObjVertices):
+    def __init__(self, data: List, texture: Texture=None, vertices_class=ObjVertices, indices: List[int]=None,
+                 mode=gl.GL_TRIANGLES, primitive_restart: bool=False, vertex_buffer: Buffer=None):
+        """
+        data is a list of vertices. If no indices are given, they are drawn in order.
+        mode is the default for drawing. With primitive_restart, negative indices
+        start a new primitive, e.g. for triangle strips (see meshopt.stripify).
+        vertex_buffer may already contain the data, e.g. uploaded by loader.AssetLoader.
+        """
         self.data = data
+        self.indices = indices
+        self.mode = mode
         self.texture = texture
         self.vao = VertexArrayObject(vertices_class=vertices_class)
-        self.vertices = self.vao.create_vertices(self.data)
+        self.vertices = self.vao.create_vertices(self.data, indices, primitive_restart=primitive_restart,
+                                                 vertex_buffer=vertex_buffer)
+        self._bvh = None
+        self.lods = None
 
     def __enter__(self):
         self.vao.__enter__()
@@ -35,17 +48,60 @@ class Mesh:
             self.texture.__exit__(exc_type, exc_val, exc_tb)
         self.vao.__exit__(exc_type, exc_val, exc_tb)
 
-    def draw(self, **kwargs):
+    def draw(self, screen_size: float=None, lod_key=None, **kwargs):
+        """
+        If the mesh has levels of detail, giving its screen_size (see lod.screen_size)
+        picks one. lod_key tells apart several objects drawn with the same mesh.
+        """
+        if self.lods and screen_size is not None:
+            indices = self.lods.select(screen_size, lod_key)
+            if indices is not None:
+                kwargs = dict(kwargs, mode=gl.GL_TRIANGLES, indices=indices)
+        kwargs.setdefault("mode", self.mode)
         with self:
             self.vertices.draw(**kwargs)
 
+    def generate_lods(self, ratios=(0.5, 0.25, 0.125), **kwargs):
+        """
+        Build simplified versions of the mesh, with the given fractions of the triangles.
+        See lod.make_lod_chain for options. Requires numpy.
+        """
+        from .lod import make_lod_chain
+        if self.lods:
+            self.lods.delete()
+        self.lods = make_lod_chain(self, ratios, **kwargs)
+        return self.lods
+
+    @property
+    def bounds(self):
+        "Axis aligned bounding box (lo, hi) of the mesh, in model space."
+        return self.vertices.bounds
+
+    @property
+    def bounding_sphere(self):
+        "Bounding sphere (center, radius) of the mesh, in model space."
+        return self.vertices.bounding_sphere
+
+    @property
+    def bvh(self):
+        """
+        Bounding volume hierarchy of the mesh's triangles, for picking (see bvh.pick).
+        Built the first time it's needed. Requires numpy.
+        """
+        if self._bvh is None:
+            from .bvh import BVH
+            self._bvh = BVH.from_mesh(self)
+        return self._bvh
+
     def __repr__(self):
-        return f"Mesh(vao={self.vao}, length={len(self.data)})"
+        return f"Mesh(vao={self.vao}, length={self.vertices.length})"
 
     def __del__(self):
         try:
             self.vao.delete()
             self.vertices.delete()
+            if self.lods:
+                self.lods.delete()
         except (AttributeError, ImportError):
             pass
     
@@ -56,8 +112,26 @@ class ObjMesh(Mesh):
     Loads data from an OBJ (loghtwave) file into a mesh.
     """
 
-    def __init__(self, path: str, texture: Texture=None):
+    def __init__(self, path: str, texture: Texture=None, optimize: bool=False, strips: bool=False,
+                 lods=None, lod_cache_dir: str=None):
+        """
+        optimize: reorder the data for faster drawing, see meshopt.optimize_mesh.
+        strips: store as triangle strips with primitive restart (implies optimize).
+        lods: fractions of the triangles to keep in each level of detail, if any.
+        """
         with open(path) as f:
             data = parse_obj_file(f)
 
-        super().__init__(data, texture, vertices_class=ObjVertices)
+        indices = None
+        mode = gl.GL_TRIANGLES
+        if optimize or strips:
+            from .meshopt import optimize_mesh, stripify
+            data, indices, self.cache_stats_before, self.cache_stats = optimize_mesh(data)
+            if strips:
+                indices = stripify(indices)
+                mode = gl.GL_TRIANGLE_STRIP
+
+        super().__init__(data, texture, vertices_class=ObjVertices, indices=indices, mode=mode,
+                         primitive_restart=strips)
+        if lods:
+            self.generate_lods(lods, cache_dir=lod_cache_dir)
@@ -0,0 +1,140 @@
+"""
+Meshlets: a mesh split into small clusters of triangles that can be culled
+separately, which helps for big meshes that are only partly visible.
+
+Each cluster gets a bounding sphere, for frustum culling, and a cone containing
+all its triangle normals, so that clusters facing away from the camera can be
+skipped. Clusters are stored one after the other in a shared index buffer, and
+the visible ones drawn with a single glMultiDrawElements call.
+"""
+
+from ctypes import c_void_p, sizeof
+from typing import Sequence
+
+import numpy as np
+from pyglet import gl
+
+from .buffer import IndexBuffer
+from .bvh import morton_codes, triangles_from_mode
+from .culling import frustum_planes, to_array
+from .util import LoggerMixin
+
+
+def partition(triangles, max_vertices: int=64, max_triangles: int=124):
+    """
+    Split the triangles (shape (n, 3)), in order, into clusters with at most the
+    given numbers of unique vertices and triangles. Returns the first triangle of
+    each cluster.
+    """
+    starts = []
+    vertices = set()
+    size = 0
+    for t, triangle in enumerate(triangles.tolist()):
+        new = vertices.union(triangle)
+        if not starts or size == max_triangles or len(new) > max_vertices:
+            starts.append(t)
+            vertices = set(triangle)
+            size = 1
+        else:
+            vertices = new
+            size += 1
+    return np.array(starts, dtype=np.intp)
+
+
+class Meshlets(LoggerMixin):
+
+    """
+    Clusters of triangles from a mesh, sharing its vertices. Triangles are
+    grouped spatially (in Morton order) unless keep_order is set, e.g. if they
+    are already ordered for the vertex cache.
+    """
+
+    def __init__(self, positions, triangles, max_vertices: int=64, max_triangles: int=124,
+                 keep_order: bool=False):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+        p0, p1, p2 = (positions[triangles[:, i]] for i in range(3))
+        if not keep_order:
+            order = np.argsort(morton_codes((p0 + p1 + p2) / 3), kind="stable")
+            triangles, p0, p1, p2 = triangles[order], p0[order], p1[order], p2[order]
+        self.triangles = triangles
+        starts = partition(triangles, max_vertices, max_triangles)
+        ends = np.append(starts[1:], len(triangles))
+        self.first = starts * 3  # In indices
+        self.count = (ends - starts) * 3
+
+        # Bounding spheres around the centers of the cluster bounding boxes
+        corners = np.stack([p0, p1, p2], axis=1)  # (n, 3 corners, 3)
+        lo = np.minimum.reduceat(corners.min(axis=1), starts)
+        hi = np.maximum.reduceat(corners.max(axis=1), starts)
+        self.centers = (lo + hi) / 2
+        cluster = np.repeat(np.arange(len(starts)), ends - starts)
+        distance = np.linalg.norm(corners - self.centers[cluster][:, None], axis=2).max(axis=1)
+        self.radii = np.maximum.reduceat(distance, starts)
+
+        # Normal cones; the axis is the average normal and the cutoff is the sine of
+        # the widest angle to any normal, or infinite if that is over 90 degrees.
+        normals = np.cross(p1 - p0, p2 - p0)
+        normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-30)[:, None]
+        axes = np.add.reduceat(normals, starts)
+        axes /= np.maximum(np.linalg.norm(axes, axis=1), 1e-30)[:, None]
+        min_dot = np.minimum.reduceat((normals * axes[cluster]).sum(axis=1), starts)
+        self.cone_axes = axes
+        self.cone_cutoffs = np.where(min_dot > 0, np.sqrt(np.maximum(1 - min_dot ** 2, 0)), np.inf)
+
+        self.index_buffer = None
+
+    @classmethod
+    def from_mesh(cls, mesh, **kwargs):
+        "Build clusters from the data of a Mesh, and upload their indices."
+        positions = np.array([vertex[0] for vertex in mesh.data], dtype=np.float32)
+        triangles = triangles_from_mode(len(positions), mesh.mode, mesh.indices)
+        meshlets = cls(positions, triangles, **kwargs)
+        meshlets.upload(mesh.vao)
+        return meshlets
+
+    def __len__(self):
+        return len(self.first)
+
+    def upload(self, vao):
+        "Put the indices of all the clusters in one index buffer."
+        with vao:
+            self.index_buffer = IndexBuffer(self.triangles.ravel())
+
+    def cull(self, view_projection: Sequence[float], camera_position: Sequence[float],
+             model_matrix: Sequence[float]=None) -> np.ndarray:
+        """
+        Return a boolean array telling which clusters may be visible, i.e. are at
+        least partly in the view frustum and not facing away from the camera.
+        Matrices are in GL order. The tests are done in model space.
+        """
+        model = np.eye(4) if model_matrix is None else to_array(model_matrix)
+        # Planes transform with the matrix that transforms points into their space
+        planes = frustum_planes(view_projection) @ model
+        distance = (self.centers @ planes[:, :3].T + planes[:, 3]) / np.linalg.norm(planes[:, :3], axis=1)
+        in_frustum = np.all(distance >= -self.radii[:, None], axis=1)
+
+        camera = np.linalg.solve(model, np.append(np.asarray(camera_position, dtype=np.float64), 1))
+        view = self.centers - camera[:3] / camera[3]
+        # Conservative test, works anywhere except inside the sphere
+        back_facing = ((view * self.cone_axes).sum(axis=1)
+                       >= self.cone_cutoffs * np.linalg.norm(view, axis=1) + self.radii)
+        return in_frustum & ~back_facing
+
+    def draw_list(self, visible: np.ndarray=None):
+        "Counts and byte offsets, as ctypes arrays, for drawing the visible clusters."
+        first, count = (self.first, self.count) if visible is None else (self.first[visible], self.count[visible])
+        offsets = first * sizeof(self.index_buffer.structure)
+        return (gl.GLsizei * len(count))(*count.tolist()), (c_void_p * len(offsets))(*offsets.tolist())
+
+    def draw(self, mesh, visible: np.ndarray=None, mode=gl.GL_TRIANGLES):
+        "Draw the visible clusters (or all of them) with the mesh's vertices and texture."
+        counts, offsets = self.draw_list(visible)
+        if not len(counts):
+            return
+        with mesh, self.index_buffer:
+            gl.glMultiDrawElements(mode, counts, self.index_buffer.gl_type, offsets, len(counts))
+
+    def delete(self):
+        if self.index_buffer:
+            self.index_buffer.delete()
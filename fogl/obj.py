@@ -83,7 +83,7 @@ def make_tuple(tupleclass, match):
     "Convert a match result into the given kind of tuple"
 
     args = {
-        field: (tupleclass._field_types[field](value)
+        field: (tupleclass.__annotations__[field](value)
                 if value is not None
                 else tupleclass._field_defaults[field])
         for field, value in match.groupdict().items()
@@ -145,10 +145,8 @@ def parse_obj_file(f):
             result.append(tuple(make_point(item.v3, color, item.vn3, item.vt3)))
         elif isinstance(item, tuple):
             if item[0] == "mtllib":
-                current_dir = os.getcwd()
-                os.chdir(os.path.dirname(f.name))
-                materials.update(parse_mtl_file(item[1]))
-                os.chdir(current_dir)
+                # Relative to the obj file. Not changing directory, since that's not thread safe.
+                materials.update(parse_mtl_file(os.path.join(os.path.dirname(f.name), item[1])))
             elif item[0] == "usemtl":
                 color = materials[item[1]]
 
@@ -0,0 +1,190 @@
+"""
+Occlusion culling using hardware occlusion queries, for skipping meshes that
+are hidden behind other things.
+"""
+
+from contextlib import contextmanager
+from typing import Sequence
+
+from pyglet import gl
+
+from .glutil import gl_matrix
+from .query import QueryPool, is_available, get_result
+from .util import LoggerMixin
+from .vao import VertexArrayObject
+from .vertex import SimpleVertices
+
+
+def _cube():
+    "Triangles of a cube from -1 to 1."
+    corners = [(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)]
+    faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    return [(corners[i],) for a, b, c, d in faces for i in (a, b, c, a, c, d)]
+
+
+def box_matrix(model_matrix: Sequence[float], bounds):
+    "Model matrix that turns the cube from -1 to 1 into the given bounds, in GL order."
+    m = list(model_matrix)
+    (x0, y0, z0), (x1, y1, z1) = bounds
+    center = (x0 + x1) / 2, (y0 + y1) / 2, (z0 + z1) / 2
+    # Tiny margin so the proxy doesn't z-fight with the mesh surfaces
+    extent = [max((b - a) / 2, 1e-6) * 1.001 for a, b in zip((x0, y0, z0), (x1, y1, z1))]
+    columns = [m[4 * j:4 * j + 4] for j in range(4)]
+    result = []
+    for j in range(3):
+        result.extend(v * extent[j] for v in columns[j])
+    result.extend(sum(columns[j][i] * center[j] for j in range(3)) + columns[3][i] for i in range(4))
+    return tuple(result)
+
+
+def _transform(matrix: Sequence[float], vector: Sequence[float]):
+    "Multiply a vector by a matrix in GL (column major) order."
+    return [sum(matrix[4 * j + i] * vector[j] for j in range(4)) for i in range(4)]
+
+
+def crosses_near_plane(view_projection: Sequence[float], model_matrix: Sequence[float], bounds) -> bool:
+    """
+    Whether any part of the bounds is closer than the camera's near plane. That
+    includes the camera being inside them.
+    """
+    (x0, y0, z0), (x1, y1, z1) = bounds
+    for corner in ((x, y, z, 1) for x in (x0, x1) for y in (y0, y1) for z in (z0, z1)):
+        x, y, z, w = _transform(view_projection, _transform(model_matrix, corner))
+        if z < -w:
+            return True
+    return False
+
+
+@contextmanager
+def conditional_render(query: int, mode=gl.GL_QUERY_WAIT):
+    "Draw calls inside are skipped by the GPU if the occlusion query found no samples."
+    gl.glBeginConditionalRender(query, mode)
+    yield
+    gl.glEndConditionalRender()
+
+
+class _State:
+
+    __slots__ = ("visible", "query")
+
+    def __init__(self):
+        self.visible = True
+        self.query = None
+
+
+class OcclusionCuller(LoggerMixin):
+
+    """
+    Draws meshes, skipping the ones that were hidden. Call begin_frame() every frame
+    before drawing, and then draw() instead of Mesh.draw. Draw the things most
+    likely to hide others (e.g. large, close things) first.
+
+    Objects that were visible last time get drawn as usual, wrapped in a query
+    to find out if they still are. Objects that were hidden instead get a cheap
+    bounding box drawn (without writing color or depth), and the real mesh is then
+    drawn conditionally, depending on whether any of the box was visible. That
+    decision is made on the GPU, so we don't have to wait for it.
+
+    Query results are only read once they are available, usually a frame or two
+    later, which means that it may take a frame for an object to be recognized as
+    hidden.
+
+    The current program is used for drawing. The model matrix is set as a uniform
+    at "model_matrix_location"; the proxy box is drawn with only the position attribute.
+
+    A proxy box reaching past the near plane gets clipped, and may look hidden even
+    if the object is right in front of the camera. Pass the camera's view projection
+    matrix to begin_frame(), and such objects are always considered visible.
+    """
+
+    def __init__(self, model_matrix_location: int=1, target=gl.GL_ANY_SAMPLES_PASSED_CONSERVATIVE):
+        self.model_matrix_location = model_matrix_location
+        self.queries = QueryPool(target)
+        self.target = target
+        self.proxy_vao = VertexArrayObject(vertices_class=SimpleVertices)
+        self.proxy = self.proxy_vao.create_vertices(_cube())
+        self._objects = {}
+        self._pending = []
+        self._view_projection = None
+
+    def begin_frame(self, view_projection: Sequence[float]=None):
+        "Collect the query results that are ready. view_projection is projection * view, in GL order."
+        self._view_projection = view_projection
+        pending = []
+        for state in self._pending:
+            if is_available(state.query):
+                state.visible = bool(get_result(state.query))
+                self.queries.release(state.query)
+                state.query = None
+            else:
+                pending.append(state)
+        self._pending = pending
+
+    def draw(self, mesh, model_matrix: Sequence[float], key=None, **kwargs):
+        """
+        Draw the mesh (unless it's hidden). The key identifies the object between
+        frames; by default it's the mesh itself, but if the same mesh is drawn several
+        times, they need different keys. Other arguments are passed to Mesh.draw.
+        """
+        key = id(mesh) if key is None else key
+        state = self._objects.get(key)
+        if state is None:
+            self._objects[key] = state = _State()
+
+        if (not state.visible and self._view_projection is not None
+                and crosses_near_plane(self._view_projection, model_matrix, mesh.bounds)):
+            state.visible = True
+
+        if state.query is not None:
+            # Still waiting for the last result; go with what we know.
+            self._set_model_matrix(model_matrix)
+            if state.visible:
+                mesh.draw(**kwargs)
+            else:
+                with conditional_render(state.query, gl.GL_QUERY_NO_WAIT):
+                    mesh.draw(**kwargs)
+            return
+
+        state.query = query = self.queries.acquire()
+        self._pending.append(state)
+        if state.visible:
+            self._set_model_matrix(model_matrix)
+            gl.glBeginQuery(self.target, query)
+            mesh.draw(**kwargs)
+            gl.glEndQuery(self.target)
+        else:
+            self._draw_proxy(query, model_matrix, mesh.bounds)
+            self._set_model_matrix(model_matrix)
+            with conditional_render(query):
+                mesh.draw(**kwargs)
+
+    def _set_model_matrix(self, model_matrix):
+        gl.glUniformMatrix4fv(self.model_matrix_location, 1, gl.GL_FALSE, gl_matrix(model_matrix))
+
+    def _draw_proxy(self, query, model_matrix, bounds):
+        self._set_model_matrix(box_matrix(model_matrix, bounds))
+        gl.glColorMask(gl.GL_FALSE, gl.GL_FALSE, gl.GL_FALSE, gl.GL_FALSE)
+        gl.glDepthMask(gl.GL_FALSE)
+        gl.glBeginQuery(self.target, query)
+        with self.proxy_vao:
+            self.proxy.draw()
+        gl.glEndQuery(self.target)
+        gl.glDepthMask(gl.GL_TRUE)
+        gl.glColorMask(gl.GL_TRUE, gl.GL_TRUE, gl.GL_TRUE, gl.GL_TRUE)
+
+    def forget(self, key):
+        "Stop tracking an object, e.g. when it's removed from the scene."
+        state = self._objects.pop(key, None)
+        if state and state.query is not None:
+            self._pending.remove(state)
+            self.queries.release(state.query)
+
+    @property
+    def hidden(self):
+        "Number of objects currently considered hidden."
+        return sum(not state.visible for state in self._objects.values())
+
+    def delete(self):
+        self.queries.delete()
+        self.proxy.delete()
+        self.proxy_vao.delete()
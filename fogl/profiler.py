@@ -0,0 +1,179 @@
+"""
+Measuring where the frame time goes, on the CPU and the GPU.
+
+Wrap parts of the frame in profiler.scope("name") and call profiler.end_frame()
+once per frame. GPU times come from timestamp queries, read back a few frames
+later when they are ready, so measuring does not stall the pipeline. Scopes
+can be nested; they are identified by their path, e.g. "frame/shadow".
+"""
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from ctypes import byref
+import json
+from time import perf_counter_ns
+from typing import Dict, List, NamedTuple
+
+from pyglet import gl
+
+from .query import QueryPool, is_available, get_result
+from .util import LoggerMixin
+
+
+class _Scope:
+
+    __slots__ = ("path", "depth", "cpu_start", "cpu_end", "gpu_start", "gpu_end")
+
+    def __init__(self, path, depth, cpu_start, gpu_start):
+        self.path = path
+        self.depth = depth
+        self.cpu_start = cpu_start
+        self.cpu_end = None
+        self.gpu_start = gpu_start  # Queries, until resolved, then nanoseconds
+        self.gpu_end = None
+
+
+class Timing(NamedTuple):
+
+    "Rolling statistics for one scope, in milliseconds."
+
+    depth: int
+    cpu_median: float
+    cpu_p95: float
+    gpu_median: float
+    gpu_p95: float
+    samples: int
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    "The value below which the given fraction of the values lie (nearest rank)."
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class Profiler(LoggerMixin):
+
+    """
+    Keeps CPU and GPU timings of named scopes for the last "history" frames.
+    Disable it to make scopes cost (almost) nothing.
+
+    GL objects are created on first use, so a profiler can be made before there
+    is a GL context. All the GL calls must happen in the same context.
+    """
+
+    def __init__(self, history: int=120, trace_frames: int=10, enabled: bool=True):
+        self.enabled = enabled
+        self.history = history
+        self._pool = None
+        self._gpu_offset = None  # GPU clock minus CPU clock, in ns
+        self._stack = []
+        self._frame = []
+        self._last_query = None  # The latest timestamp query issued this frame
+        self._pending = deque()  # (frame, last query), waiting for query results
+        self._times = defaultdict(lambda: (deque(maxlen=history), deque(maxlen=history)))
+        self._depths = {}
+        self.frames = deque(maxlen=trace_frames)  # Resolved frames, for tracing
+        self.frame_count = 0
+
+    def _start(self):
+        self._pool = QueryPool(gl.GL_TIMESTAMP, 64)
+        gpu_time = gl.GLint64()
+        gl.glGetInteger64v(gl.GL_TIMESTAMP, byref(gpu_time))
+        self._gpu_offset = gpu_time.value - perf_counter_ns()
+
+    def _timestamp(self) -> int:
+        query = self._pool.acquire()
+        gl.glQueryCounter(query, gl.GL_TIMESTAMP)
+        self._last_query = query
+        return query
+
+    @contextmanager
+    def scope(self, name: str):
+        "Measure the CPU and GPU time taken by the GL commands issued inside."
+        if not self.enabled:
+            yield
+            return
+        if self._pool is None:
+            self._start()
+        path = f"{self._stack[-1].path}/{name}" if self._stack else name
+        scope = _Scope(path, len(self._stack), perf_counter_ns(), self._timestamp())
+        self._stack.append(scope)
+        self._frame.append(scope)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            scope.gpu_end = self._timestamp()
+            scope.cpu_end = perf_counter_ns()
+
+    def end_frame(self):
+        "Call once per frame, outside any scope. Collects the results that are ready."
+        self.frame_count += 1
+        if self._frame:
+            self._pending.append((self._frame, self._last_query))
+            self._frame = []
+        # Queries finish in order, so checking the last one issued in each frame is
+        # enough. That's not necessarily the last scope's end, when scopes are nested.
+        while self._pending and is_available(self._pending[0][1]):
+            self._resolve(self._pending.popleft()[0])
+
+    def _resolve(self, frame):
+        for scope in frame:
+            for attr in ("gpu_start", "gpu_end"):
+                query = getattr(scope, attr)
+                setattr(scope, attr, get_result(query) - self._gpu_offset)
+                self._pool.release(query)
+            cpu_times, gpu_times = self._times[scope.path]
+            cpu_times.append((scope.cpu_end - scope.cpu_start) / 1e6)
+            gpu_times.append((scope.gpu_end - scope.gpu_start) / 1e6)
+            self._depths[scope.path] = scope.depth
+        self.frames.append(frame)
+
+    def timings(self) -> Dict[str, Timing]:
+        "Statistics for every scope seen, in the order they were first seen."
+        result = {}
+        for path, (cpu_times, gpu_times) in self._times.items():
+            cpu, gpu = list(cpu_times), list(gpu_times)
+            result[path] = Timing(self._depths[path], percentile(cpu, 0.5), percentile(cpu, 0.95),
+                                  percentile(gpu, 0.5), percentile(gpu, 0.95), len(cpu))
+        return result
+
+    def chrome_trace(self) -> dict:
+        """
+        The recent frames as a Chrome trace (open in chrome://tracing or Perfetto),
+        with CPU and GPU on separate rows. Times are in microseconds.
+        """
+        events = []
+        for frame in self.frames:
+            for scope in frame:
+                name = scope.path.rsplit("/", 1)[-1]
+                for tid, start, end in ((0, scope.cpu_start, scope.cpu_end),
+                                        (1, scope.gpu_start, scope.gpu_end)):
+                    events.append(dict(name=name, cat=scope.path, ph="X", pid=0, tid=tid,
+                                       ts=start / 1000, dur=(end - start) / 1000))
+        metadata = [dict(name="thread_name", ph="M", pid=0, tid=tid, args=dict(name=name))
+                    for tid, name in ((0, "CPU"), (1, "GPU"))]
+        return dict(traceEvents=metadata + events, displayTimeUnit="ms")
+
+    def export_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def clear(self):
+        self._times.clear()
+        self._depths.clear()
+        self.frames.clear()
+
+    def delete(self):
+        if self._pool is not None:
+            self._pool.delete()
+            self._pool = None
+        self._pending.clear()
+        self._frame = []
+        self._last_query = None
+
+
+# The profiler used by the debug window; scopes can be added anywhere.
+profiler = Profiler()
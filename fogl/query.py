@@ -0,0 +1,60 @@
+"""
+GL query objects, e.g. for occlusion tests and timing.
+"""
+
+from ctypes import byref
+
+from pyglet import gl
+
+from .deletion import deletion_queue
+
+
+class QueryPool:
+
+    """
+    Keeps a bunch of query objects of one type around for reuse, since creating
+    them every frame is wasteful. Grows as needed.
+    """
+
+    def __init__(self, target=gl.GL_ANY_SAMPLES_PASSED_CONSERVATIVE, size: int=32):
+        self.target = target
+        self._free = []
+        self._all = []
+        self._grow(size)
+
+    def _grow(self, count):
+        names = (gl.GLuint * count)()
+        gl.glCreateQueries(self.target, count, names)
+        self._free.extend(names)
+        self._all.extend(names)
+
+    def acquire(self) -> int:
+        if not self._free:
+            self._grow(len(self._all))
+        return self._free.pop()
+
+    def release(self, query: int):
+        self._free.append(query)
+
+    def __len__(self):
+        return len(self._all)
+
+    def delete(self):
+        for query in self._all:
+            deletion_queue.push("query", query)
+        self._all = []
+        self._free = []
+
+
+def is_available(query: int) -> bool:
+    "Check if the query's result can be read without waiting."
+    available = gl.GLuint()
+    gl.glGetQueryObjectuiv(query, gl.GL_QUERY_RESULT_AVAILABLE, byref(available))
+    return bool(available.value)
+
+
+def get_result(query: int) -> int:
+    "Read the result of the query. Waits if it's not available yet!"
+    result = gl.GLuint64()
+    gl.glGetQueryObjectui64v(query, gl.GL_QUERY_RESULT, byref(result))
+    return result.value
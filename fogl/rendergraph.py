@@ -0,0 +1,252 @@
+"""
+A simple render graph, for setting up pipelines of several rendering passes.
+
+Instead of wiring framebuffers and textures together by hand, each pass declares
+which named attachments (textures) it reads and writes. The graph then figures
+out in what order the passes must run, skips passes whose results are never
+used, and lets transient attachments with non-overlapping lifetimes share the
+same texture.
+
+    graph = RenderGraph(window_size)
+    graph.add_attachment("color", Texture)
+    graph.add_attachment("normal", NormalTexture)
+    graph.add_attachment("depth", DepthTexture)
+    graph.add_pass("geometry", draw_scene, writes=["color", "normal", "depth"],
+                   program=view_program)
+    graph.add_pass("lighting", draw_quad, reads=["color", "normal"],
+                   program=lighting_program)  # No writes; draws to the screen
+    ...
+    graph.execute()  # Every frame
+
+The graph is compiled (and the textures and framebuffers created) the first time
+it's executed after being changed.
+"""
+
+from contextlib import ExitStack
+from typing import Callable, Dict, List, Mapping, NamedTuple, Sequence, Tuple, Type, Union
+
+from pyglet import gl
+
+from .framebuffer import FrameBuffer, DISCARD
+from .shader import Program
+from .texture import Texture, DepthTexture
+from .util import LoggerMixin
+
+
+class Attachment(NamedTuple):
+
+    name: str
+    texture_class: Type[Texture]
+    size: Tuple[int, int] = None  # None means the size of the graph
+    transient: bool = True  # Non-transient attachments are outputs of the graph
+
+
+class Pass(NamedTuple):
+
+    name: str
+    execute: Callable[[Dict[str, Texture]], None]
+    reads: Dict[str, int]  # attachment name -> texture unit
+    writes: List[str]
+    program: Program = None
+    clear: bool = True
+    image_writes: bool = False  # Writes attachments through image load/store
+
+
+class CompiledGraph(NamedTuple):
+
+    passes: List[Pass]
+    framebuffers: Dict[str, FrameBuffer]
+    textures: Dict[str, Texture]
+    barriers: Dict[str, int]
+
+
+class RenderGraph(LoggerMixin):
+
+    def __init__(self, size: Tuple[int, int]):
+        self.size = size
+        self.attachments: Dict[str, Attachment] = {}
+        self.passes: Dict[str, Pass] = {}
+        self._compiled = None
+
+    def add_attachment(self, name: str, texture_class: Type[Texture]=Texture,
+                       size: Tuple[int, int]=None, transient: bool=True):
+        """
+        Declare a texture that passes can render to, and read from. Transient
+        attachments only live during execution of the graph and may share
+        memory with each other. Other attachments are considered outputs; they are
+        kept around and available e.g. for reading pixels afterwards.
+        """
+        self.attachments[name] = Attachment(name, texture_class, size, transient)
+        self._invalidate()
+
+    def add_pass(self, name: str, execute: Callable[[Dict[str, Texture]], None],
+                 reads: Union[Sequence[str], Mapping[str, int]]=(), writes: Sequence[str]=(),
+                 program: Program=None, clear: bool=True, image_writes: bool=False):
+        """
+        Declare a rendering pass. The execute callback is called with a dict of the
+        attachment textures, with the framebuffer for the "writes" attachments and
+        the program active, and the "reads" attachments bound to texture units.
+        Reads may be given as a mapping to units, or as a list in unit order.
+
+        A pass that writes nothing draws to the default framebuffer, and is never
+        culled. Each attachment can only be written by one pass.
+        """
+        if not isinstance(reads, Mapping):
+            reads = {attachment: unit for unit, attachment in enumerate(reads)}
+        self.passes[name] = Pass(name, execute, dict(reads), list(writes), program, clear, image_writes)
+        self._invalidate()
+
+    def remove_pass(self, name: str):
+        del self.passes[name]
+        self._invalidate()
+
+    def resize(self, size: Tuple[int, int]):
+        if size != self.size:
+            self.size = size
+            self._invalidate()
+
+    def _invalidate(self):
+        "Drop the compiled graph (deleting its framebuffers), to compile it again when needed."
+        self.delete()
+
+    def __getitem__(self, attachment: str) -> Texture:
+        "Get the texture of a (non-transient) attachment."
+        return self.compile().textures[attachment]
+
+    def _get_writers(self):
+        writers = {}
+        for p in self.passes.values():
+            for attachment in list(p.reads) + p.writes:
+                if attachment not in self.attachments:
+                    raise KeyError(f"Pass {p.name} uses undeclared attachment {attachment}.")
+            for attachment in p.writes:
+                if attachment in writers:
+                    raise ValueError(f"Attachment {attachment} is written by both "
+                                     f"{writers[attachment]} and {p.name}.")
+                if attachment in p.reads:
+                    raise ValueError(f"Pass {p.name} can't both read and write {attachment}.")
+                writers[attachment] = p.name
+        return writers
+
+    def _sort_passes(self, writers):
+        "Cull unused passes and return the rest in execution order."
+        # Walk backwards from the passes that produce something visible
+        needed = set()
+        stack = [p.name for p in self.passes.values()
+                 if not p.writes or any(not self.attachments[a].transient for a in p.writes)]
+        while stack:
+            name = stack.pop()
+            if name in needed:
+                continue
+            needed.add(name)
+            for attachment in self.passes[name].reads:
+                if attachment not in writers:
+                    raise ValueError(f"Attachment {attachment}, read by pass {name}, is never written.")
+                stack.append(writers[attachment])
+
+        # Topological sort, keeping the declaration order where possible
+        order = []
+        done = set()
+        remaining = [p for p in self.passes.values() if p.name in needed]
+        while remaining:
+            for p in remaining:
+                if all(writers[a] in done for a in p.reads):
+                    order.append(p)
+                    done.add(p.name)
+                    remaining.remove(p)
+                    break
+            else:
+                raise ValueError(f"Render graph has a cycle, between {[p.name for p in remaining]}.")
+        culled = set(self.passes) - needed
+        if culled:
+            self.logger.debug("Culled unused passes %s", culled)
+        return order
+
+    def _allocate(self, order):
+        "Create textures for the attachments, sharing them where lifetimes don't overlap."
+        lifetimes = {}
+        for i, p in enumerate(order):
+            for attachment in list(p.reads) + p.writes:
+                first, _ = lifetimes.get(attachment, (i, i))
+                lifetimes[attachment] = first, i
+
+        textures = {}
+        slots = []  # [(key, texture, last use)]
+        for attachment, (first, last) in sorted(lifetimes.items(), key=lambda item: item[1]):
+            texture_class, size = self.attachments[attachment][1:3]
+            size = size or self.size
+            if not self.attachments[attachment].transient:
+                textures[attachment] = texture_class(size)
+                continue
+            key = texture_class, tuple(size)
+            for i, (slot_key, texture, slot_last) in enumerate(slots):
+                if slot_key == key and slot_last < first:
+                    slots[i] = slot_key, texture, last
+                    self.logger.debug("Attachment %s shares texture with an earlier one", attachment)
+                    break
+            else:
+                texture = texture_class(size)
+                slots.append((key, texture, last))
+            textures[attachment] = texture
+        return textures
+
+    def compile(self) -> CompiledGraph:
+        "Prepare the graph for execution. Only does any work if something changed."
+        if self._compiled:
+            return self._compiled
+
+        writers = self._get_writers()
+        order = self._sort_passes(writers)
+        textures = self._allocate(order)
+
+        framebuffers = {}
+        barriers = {}
+        for p in order:
+            if p.writes:
+                color = [a for a in p.writes if not issubclass(self.attachments[a].texture_class, DepthTexture)]
+                depth = [a for a in p.writes if a not in color]
+                if len(depth) > 1:
+                    raise ValueError(f"Pass {p.name} writes more than one depth attachment.")
+                size = self.attachments[p.writes[0]].size or self.size
+                framebuffers[p.name] = FrameBuffer(size, {a: textures[a] for a in color},
+                                                   depth=textures[depth[0]] if depth else None,
+                                                   indices={a: i for i, a in enumerate(color)},
+                                                   autoclear=p.clear, set_viewport=True,
+                                                   # Nobody can read a depth buffer we made up
+                                                   store={} if depth else {"depth": DISCARD})
+            # Rendering to a texture and then sampling it is synchronized by GL,
+            # but not writes through image load/store.
+            if any(self.passes[writers[a]].image_writes for a in p.reads):
+                barriers[p.name] = gl.GL_TEXTURE_FETCH_BARRIER_BIT | gl.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT
+
+        self.logger.debug("Compiled render graph: %s", [p.name for p in order])
+        self._compiled = CompiledGraph(order, framebuffers, textures, barriers)
+        return self._compiled
+
+    def execute(self):
+        "Run all the passes."
+        compiled = self.compile()
+        for p in compiled.passes:
+            barrier = compiled.barriers.get(p.name)
+            if barrier:
+                gl.glMemoryBarrier(barrier)
+            framebuffer = compiled.framebuffers.get(p.name)
+            with ExitStack() as stack:
+                if framebuffer:
+                    stack.enter_context(framebuffer)
+                else:
+                    gl.glViewport(0, 0, *self.size)
+                if p.program:
+                    stack.enter_context(p.program)
+                # Textures may be read on different units by different passes, so
+                # bind them directly instead of through their own unit.
+                for attachment, unit in p.reads.items():
+                    gl.glBindTextureUnit(unit, compiled.textures[attachment].name)
+                    stack.callback(gl.glBindTextureUnit, unit, 0)
+                p.execute(compiled.textures)
+
+    def delete(self):
+        if self._compiled:
+            for framebuffer in self._compiled.framebuffers.values():
+                framebuffer.delete()
+            self._compiled = None
@@ -0,0 +1,155 @@
+"""
+Pooling of transient render targets, i.e. textures and framebuffers that are
+only needed for part of a frame.
+"""
+
+from collections import defaultdict
+from typing import Mapping, Tuple, Type
+
+from .framebuffer import FrameBuffer
+from .resources import texture_memory
+from .texture import Texture
+from .util import LoggerMixin
+
+
+class _Entry:
+
+    def __init__(self, resource, size):
+        self.resource = resource
+        self.size = size
+        self.last_used = 0
+
+
+class RenderTargetPool(LoggerMixin):
+
+    """
+    Hands out textures and framebuffers of a given size and format, reusing
+    ones that have been released instead of allocating new ones. Everything handed
+    out during a frame is released by end_frame(), so the same objects can be
+    reused e.g. by each step of a post processing chain, or next frame.
+
+    Entries that have not been used for "max_idle_frames" frames are deleted,
+    which takes care of targets of an old size after the window is resized. If
+    allocating would make the pool use more than "budget" bytes, idle entries are
+    deleted right away, oldest first.
+
+    Don't hold on to anything from the pool after end_frame!
+    """
+
+    def __init__(self, max_idle_frames: int=3, budget: int=None):
+        self.max_idle_frames = max_idle_frames
+        self.budget = budget
+        self.frame = 0
+        self._idle = defaultdict(list)  # key -> entries free to hand out
+        self._in_use = {}  # id(resource) -> (key, entry)
+        self.allocated = 0  # bytes
+        self.high_water_mark = 0
+
+    def texture(self, size: Tuple[int, int], texture_class: Type[Texture]=Texture, unit: int=0,
+                params: Mapping[int, int]={}) -> Texture:
+        "Get a texture of the given size and class."
+        key = ("texture", tuple(size), texture_class, tuple(sorted(params.items())))
+        entry = self._take(key)
+        if entry is None:
+            texture = texture_class(size, unit=unit, params=params)
+            entry = self._add(key, texture, texture_memory(texture))
+        texture = entry.resource
+        texture.unit = unit
+        return texture
+
+    def framebuffer(self, size: Tuple[int, int], textures: Mapping[str, Tuple[Type[Texture], int]]={},
+                    depth_unit: int=None, autoclear: bool=False, set_viewport: bool=False) -> FrameBuffer:
+        """
+        Get a framebuffer of the given size. Textures are specified as a mapping from
+        name to (texture class, unit).
+        """
+        key = ("framebuffer", tuple(size), tuple(sorted(textures.items())), depth_unit)
+        entry = self._take(key)
+        if entry is None:
+            fb_textures = {name: texture_class(size, unit=unit)
+                           for name, (texture_class, unit) in textures.items()}
+            framebuffer = FrameBuffer(size, fb_textures, depth_unit=depth_unit)
+            entry = self._add(key, framebuffer, sum(texture_memory(t) for t in framebuffer.textures.values()))
+        framebuffer = entry.resource
+        framebuffer.autoclear = autoclear
+        framebuffer.set_viewport = set_viewport
+        return framebuffer
+
+    def release(self, resource):
+        "Give something back to the pool before the end of the frame."
+        key, entry = self._in_use.pop(id(resource))
+        entry.last_used = self.frame
+        self._idle[key].append(entry)
+
+    def end_frame(self):
+        "Release everything handed out, and delete entries that have been idle too long."
+        for key, entry in self._in_use.values():
+            entry.last_used = self.frame
+            self._idle[key].append(entry)
+        self._in_use.clear()
+        self.frame += 1
+        self._evict(lambda entry: self.frame - entry.last_used > self.max_idle_frames)
+
+    def clear(self):
+        "Delete all idle entries."
+        self._evict(lambda entry: True)
+
+    def _take(self, key):
+        entries = self._idle.get(key)
+        if not entries:
+            return None
+        entry = entries.pop()
+        self._in_use[id(entry.resource)] = key, entry
+        return entry
+
+    def _add(self, key, resource, size):
+        if self.budget is not None and self.allocated + size > self.budget:
+            self._make_room(size)
+        entry = _Entry(resource, size)
+        self._in_use[id(resource)] = key, entry
+        self.allocated += size
+        self.high_water_mark = max(self.high_water_mark, self.allocated)
+        self.logger.debug("Allocated %r for %r (%d bytes in pool)", resource, key, self.allocated)
+        return entry
+
+    def _make_room(self, size):
+        idle = sorted(((entry.last_used, key, entry)
+                       for key, entries in self._idle.items()
+                       for entry in entries), key=lambda item: item[0])
+        for _, key, entry in idle:
+            if self.allocated + size <= self.budget:
+                break
+            self._idle[key].remove(entry)
+            self._delete(entry)
+        if self.allocated + size > self.budget:
+            self.logger.warning("Render target pool is over budget: %d + %d > %d bytes",
+                                self.allocated, size, self.budget)
+
+    def _evict(self, predicate):
+        for key, entries in list(self._idle.items()):
+            keep = []
+            for entry in entries:
+                if predicate(entry):
+                    self._delete(entry)
+                else:
+                    keep.append(entry)
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+
+    def _delete(self, entry):
+        # Delete right away, instead of whenever the textures are garbage
+        # collected, so that the memory is really freed when we say so.
+        if isinstance(entry.resource, FrameBuffer):
+            entry.resource.delete()
+            for texture in entry.resource.textures.values():
+                texture.delete()
+        else:
+            entry.resource.delete()
+        self.allocated -= entry.size
+
+    def __repr__(self):
+        in_use = len(self._in_use)
+        idle = sum(len(entries) for entries in self._idle.values())
+        return f"{self.__class__.__name__}(in_use={in_use}, idle={idle}, allocated={self.allocated})"
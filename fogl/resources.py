@@ -0,0 +1,185 @@
+"""
+Book keeping of GL resources (buffers, textures, framebuffers...), mostly for
+debugging: what exists right now, roughly how much GPU memory it uses, and
+what got lost without being deleted.
+
+Resources register themselves when created. Only weak references are kept,
+so the registry does not keep anything alive.
+"""
+
+from collections import defaultdict, deque
+from functools import partial
+from threading import Lock
+import traceback
+from typing import Dict, List, NamedTuple
+import weakref
+
+from pyglet import gl
+
+from .util import LoggerMixin
+
+
+# Bytes per texel of internal texture formats. Drivers may pad some (e.g. RGB8) further.
+FORMAT_SIZES = {
+    gl.GL_R8: 1, gl.GL_R8UI: 1,
+    gl.GL_RG8: 2, gl.GL_R16F: 2, gl.GL_DEPTH_COMPONENT16: 2,
+    gl.GL_RGB8: 3, gl.GL_RGB8UI: 3,
+    gl.GL_RGBA8: 4, gl.GL_RGBA8UI: 4, gl.GL_SRGB8_ALPHA8: 4, gl.GL_RG16F: 4, gl.GL_R32F: 4,
+    gl.GL_R32UI: 4, gl.GL_DEPTH_COMPONENT24: 4, gl.GL_DEPTH_COMPONENT32F: 4, gl.GL_DEPTH24_STENCIL8: 4,
+    gl.GL_RGBA16F: 8, gl.GL_RG32F: 8,
+    gl.GL_RGBA32F: 16,
+}
+
+
+def texture_memory(texture) -> int:
+    "Rough number of bytes of GPU memory used by a texture, from its internal format."
+    total = FORMAT_SIZES.get(texture._type, 4)
+    for extent in texture.size:
+        total *= extent
+    return total
+
+
+def estimate_memory(resource) -> int:
+    "Rough number of bytes of GPU memory used by a buffer or texture, 0 for other things."
+    size = getattr(resource, "size", None)
+    if isinstance(size, int):
+        return size * getattr(resource, "count", 1)  # Buffers, rings of buffers
+    if size and hasattr(resource, "_type"):
+        return texture_memory(resource)
+    return 0
+
+
+class _Entry:
+
+    __slots__ = ("ref", "category", "size", "origin")
+
+    def __init__(self, ref, category, size, origin):
+        self.ref = ref
+        self.category = category
+        self.size = size
+        self.origin = origin
+
+
+class CategorySummary(NamedTuple):
+
+    count: int
+    size: int  # bytes
+    high_water_mark: int  # bytes
+
+
+class Leak(NamedTuple):
+
+    "A resource that was garbage collected without being deleted, so its GL object lives on."
+
+    category: str
+    size: int
+    origin: str  # Where it was created, if tracking origins
+
+
+class ResourceRegistry(LoggerMixin):
+
+    """
+    Keeps track of live GL resources by category. With track_origins, the stack
+    where each resource was created is remembered too, which is slow but helps
+    finding leaks.
+
+    Removals and collections happen from __del__ and weakref callbacks, i.e.
+    whenever the garbage collector runs, possibly while this thread holds the
+    lock. So they take no lock; they are put in a deque, which is handled the
+    next time the lock is taken.
+    """
+
+    def __init__(self, track_origins: bool=False):
+        self.track_origins = track_origins
+        self._entries: Dict[int, _Entry] = {}
+        self._lock = Lock()
+        self.counts = defaultdict(int)
+        self.sizes = defaultdict(int)
+        self.high_water_marks = defaultdict(int)
+        self.leaks: List[Leak] = []
+        self._changes = deque()  # (key, ref, leaked) of removed or collected resources
+
+    def add(self, resource, category: str):
+        "Start tracking a resource."
+        key = id(resource)
+        size = estimate_memory(resource)
+        origin = "".join(traceback.format_stack(limit=10)[:-2]) if self.track_origins else None
+        entry = _Entry(weakref.ref(resource, partial(self._collected, key)), category, size, origin)
+        with self._lock:
+            self._handle_changes()
+            self._entries[key] = entry
+            self.counts[category] += 1
+            self.sizes[category] += size
+            self.high_water_marks[category] = max(self.high_water_marks[category], self.sizes[category])
+
+    def remove(self, resource):
+        "Stop tracking a resource, when it's deleted. Safe to call more than once."
+        key = id(resource)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._changes.append((key, entry.ref, False))
+
+    def _forget(self, entry):
+        if entry is not None:
+            self.counts[entry.category] -= 1
+            self.sizes[entry.category] -= entry.size
+
+    def _collected(self, key, ref):
+        self._changes.append((key, ref, True))
+
+    def _handle_changes(self):
+        "Call with the lock held."
+        while self._changes:
+            key, ref, leaked = self._changes.popleft()
+            entry = self._entries.get(key)
+            if entry is None or entry.ref is not ref:
+                continue  # Already handled
+            del self._entries[key]
+            self._forget(entry)
+            if leaked:
+                self.leaks.append(Leak(entry.category, entry.size, entry.origin))
+
+    def resources(self, category: str=None) -> list:
+        "The live resources, optionally of one category."
+        with self._lock:
+            self._handle_changes()
+            entries = list(self._entries.values())
+        resources = (entry.ref() for entry in entries
+                     if category is None or entry.category == category)
+        return [resource for resource in resources if resource is not None]
+
+    def summary(self) -> Dict[str, CategorySummary]:
+        "Count, memory use and peak memory use for each category."
+        with self._lock:
+            self._handle_changes()
+            return {category: CategorySummary(self.counts[category], self.sizes[category],
+                                              self.high_water_marks[category])
+                    for category in self.high_water_marks}
+
+    @property
+    def total_size(self) -> int:
+        with self._lock:
+            self._handle_changes()
+            return sum(self.sizes.values())
+
+    def leak_report(self) -> str:
+        "Describe resources that were collected without being deleted."
+        with self._lock:
+            self._handle_changes()
+        lines = [f"{len(self.leaks)} leaked resources"]
+        by_category = defaultdict(list)
+        for leak in self.leaks:
+            by_category[leak.category].append(leak)
+        for category, leaks in sorted(by_category.items()):
+            lines.append(f"  {category}: {len(leaks)}, {sum(leak.size for leak in leaks)} bytes")
+            for leak in leaks:
+                if leak.origin:
+                    lines.append("    Created at:\n" + leak.origin)
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(resources={len(self._entries)}, size={self.total_size})"
+
+
+# The registry used by all fogl resources.
+registry = ResourceRegistry()
@@ -1,9 +1,13 @@
 from abc import ABCMeta
 from ctypes import cast, pointer, byref, create_string_buffer, POINTER, c_char
 import io
+from math import ceil
+from typing import Dict, Mapping, Sequence
 
 from pyglet import gl
 
+from .deletion import release
+from .resources import registry
 from .util import LoggerMixin
 
 
@@ -62,17 +66,32 @@ class FragmentShader(Shader):
     kind = gl.GL_FRAGMENT_SHADER
 
 
+class ComputeShader(Shader):
+
+    kind = gl.GL_COMPUTE_SHADER
+
+
 class Program(LoggerMixin):
 
     """
     A program consists of a set of Shaders. It should contain at least a
     vertex shader and a fragment shader. Geometry shader is optional.
+
+    Varyings are the names of outputs to capture with transform feedback (see
+    feedback.TransformFeedback), interleaved into one buffer unless "interleaved"
+    is False.
     """
 
-    def __init__(self, *shaders: Shader):
+    def __init__(self, *shaders: Shader, varyings: Sequence[str]=None, interleaved: bool=True):
         self.name = gl.glCreateProgram()
         for shader in shaders:
             gl.glAttachShader(self.name, shader.name)
+        self.varyings = varyings
+        if varyings:
+            names = [create_string_buffer(v.encode()) for v in varyings]
+            pointers = (POINTER(c_char) * len(names))(*(cast(n, POINTER(c_char)) for n in names))
+            gl.glTransformFeedbackVaryings(self.name, len(names), pointers,
+                                           gl.GL_INTERLEAVED_ATTRIBS if interleaved else gl.GL_SEPARATE_ATTRIBS)
 
         gl.glLinkProgram(self.name)
         success = gl.GLint(0)
@@ -93,9 +112,83 @@ class Program(LoggerMixin):
         # free resources
         for shader in shaders:
             gl.glDeleteShader(shader.name)
+        registry.add(self, "program")
+
+    def delete(self):
+        release(self, "program")
 
     def __enter__(self):
         gl.glUseProgram(self.name)
 
     def __exit__(self, *_):
         gl.glUseProgram(0)
+
+
+class ComputeProgram(Program):
+
+    """
+    A program containing a compute shader. Dispatch it while it's in use, e.g.
+
+        with program:
+            gl.glUniform1f(0, dt)
+            program.dispatch_for(n_particles)
+        memory_barrier(gl.GL_VERTEX_ATTRIB_ARRAY_BARRIER_BIT)
+
+    Buffers and images are bound with Buffer.bind_storage and Texture.bind_image.
+    """
+
+    def __init__(self, shader: ComputeShader):
+        super().__init__(shader)
+        size = (gl.GLint * 3)()
+        gl.glGetProgramiv(self.name, gl.GL_COMPUTE_WORK_GROUP_SIZE, size)
+        self.local_size = tuple(size)
+
+    def dispatch(self, x: int, y: int=1, z: int=1):
+        "Run the given number of work groups."
+        gl.glDispatchCompute(x, y, z)
+
+    def dispatch_for(self, x: int, y: int=1, z: int=1):
+        "Run enough work groups to cover the given number of invocations."
+        gl.glDispatchCompute(*(ceil(n / size) for n, size in zip((x, y, z), self.local_size)))
+
+    def dispatch_indirect(self, buffer, offset: int=0):
+        "Run the number of work groups given by three uints in the buffer, e.g. written by another shader."
+        gl.glBindBuffer(gl.GL_DISPATCH_INDIRECT_BUFFER, buffer.name)
+        gl.glDispatchComputeIndirect(offset)
+        gl.glBindBuffer(gl.GL_DISPATCH_INDIRECT_BUFFER, 0)
+
+
+def memory_barrier(barriers=gl.GL_ALL_BARRIER_BITS):
+    """
+    Make writes from shaders (e.g. to storage buffers or images) visible to later
+    commands. The barrier bits tell how the data will be used next, e.g.
+    GL_SHADER_STORAGE_BARRIER_BIT for other shaders reading the buffer, or
+    GL_BUFFER_UPDATE_BARRIER_BIT for reading it back.
+    """
+    gl.glMemoryBarrier(barriers)
+
+
+def run_compute(program: ComputeProgram, buffers: Mapping[int, "np.ndarray"],
+                groups: Sequence[int]=None) -> Dict[int, "np.ndarray"]:
+    """
+    Mostly for testing: upload numpy arrays to storage buffers at the given binding
+    indices, run the program, and return the new contents of the buffers, as arrays
+    of the same type and shape. By default one invocation per element of the first
+    buffer is run.
+    """
+    from .buffer import Buffer
+    gpu_buffers = {index: Buffer(array) for index, array in buffers.items()}
+    for index, buffer in gpu_buffers.items():
+        buffer.bind_storage(index)
+    with program:
+        if groups is None:
+            program.dispatch_for(len(next(iter(buffers.values()))))
+        else:
+            program.dispatch(*groups)
+    memory_barrier(gl.GL_BUFFER_UPDATE_BARRIER_BIT)
+    results = {}
+    for index, buffer in gpu_buffers.items():
+        array = buffers[index]
+        results[index] = buffer.read(array.dtype).reshape(array.shape)
+        buffer.delete()
+    return results
@@ -2,13 +2,21 @@
 Functionality related to textures.
 """
 
-from ctypes import byref
+from contextlib import contextmanager
+from ctypes import byref, memmove
 from math import pi, sqrt
 from typing import Tuple, Mapping, List
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 from pyglet import gl
 
+from .buffer import BufferRing
 from .glutil import gl_matrix
+from .deletion import release
+from .resources import registry
 
 
 # The default texture parameters.
@@ -20,7 +28,106 @@ DEFAULT_PARAMS = dict([
 ])
 
 
-class Texture:
+class StreamingMixin:
+
+    """
+    Lets a 2D texture (or a layer of an array texture) be updated with new pixel
+    data, e.g. every frame for video.
+
+    Uploads go through a ring of pixel unpack buffers, so that copying the data
+    does not have to wait for the GPU to finish with the previous upload, and the
+    actual transfer happens asynchronously.
+
+    The data must match the texture's "_format" and "_data_type", and be tightly
+    packed (i.e. rows of w * _pixel_size bytes).
+    """
+
+    _format = gl.GL_RGBA
+    _data_type = gl.GL_UNSIGNED_BYTE
+    _pixel_size = 4  # bytes
+
+    upload_buffers = 3  # How many uploads may be in flight at the same time
+
+    _upload_ring = None
+
+    def _get_upload_ring(self):
+        if self._upload_ring is None:
+            w, h = self.size[:2]
+            self._upload_ring = BufferRing(w * h * self._pixel_size, self.upload_buffers)
+        return self._upload_ring
+
+    def _get_region(self, region, layer=None):
+        w, h = self.size[:2]
+        x0, y0, rw, rh = region or (0, 0, w, h)
+        if x0 < 0 or y0 < 0 or x0 + rw > w or y0 + rh > h:
+            raise ValueError(f"Region {region} is outside of texture of size {self.size}.")
+        layers = self.size[2] if len(self.size) > 2 else None
+        if (layer is None) != (layers is None) or (layer is not None and not 0 <= layer < layers):
+            raise ValueError(f"Layer {layer} is not valid for texture of size {self.size}.")
+        return x0, y0, rw, rh
+
+    def _upload(self, buffer_name, region, layer=None):
+        x, y, w, h = region
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, buffer_name)
+        if layer is None:
+            gl.glTextureSubImage2D(self.name, 0, x, y, w, h, self._format, self._data_type, None)
+        else:
+            gl.glTextureSubImage3D(self.name, 0, x, y, layer, w, h, 1, self._format, self._data_type, None)
+        gl.glBindBuffer(gl.GL_PIXEL_UNPACK_BUFFER, 0)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 4)
+        self._upload_ring.release()
+
+    def update(self, data, region: Tuple[int, int, int, int]=None, layer: int=None):
+        """
+        Replace the contents of the given region (x, y, w, h), by default the whole
+        texture. Data can be anything supporting the buffer protocol, e.g. bytes
+        or a numpy array. Array textures need the layer to update.
+        """
+        region = self._get_region(region, layer)
+        _, _, w, h = region
+        size = w * h * self._pixel_size
+        if np and isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data)
+            source, length = data.ctypes.data, data.nbytes
+        else:
+            source = data = bytes(data)
+            length = len(data)
+        if length != size:
+            raise ValueError(f"Expected {size} bytes of data for region {region}, got {length}.")
+        buffer_name, address = self._get_upload_ring().acquire()
+        memmove(address, source, size)
+        self._upload(buffer_name, region, layer)
+
+    @contextmanager
+    def mapped(self, region: Tuple[int, int, int, int]=None, dtype="uint8", layer: int=None):
+        """
+        Write directly into upload memory through a numpy array of shape (h, w, channels),
+        avoiding an extra copy. The region is uploaded when the context exits.
+        Make sure to write every pixel, the previous contents are undefined.
+        Array textures need the layer to write to.
+
+            with texture.mapped() as pixels:
+                pixels[:] = frame
+        """
+        if np is None:
+            raise RuntimeError("Mapping texture data requires numpy.")
+        region = self._get_region(region, layer)
+        _, _, w, h = region
+        dtype = np.dtype(dtype)
+        channels = self._pixel_size // dtype.itemsize
+        buffer_name, address = self._get_upload_ring().acquire()
+        memory = (gl.GLubyte * (w * h * self._pixel_size)).from_address(address)
+        yield np.frombuffer(memory, dtype=dtype).reshape(h, w, channels)
+        self._upload(buffer_name, region, layer)
+
+    def _delete_upload_ring(self):
+        if self._upload_ring is not None:
+            self._upload_ring.delete()
+            self._upload_ring = None
+
+
+class Texture(StreamingMixin):
 
     _type = gl.GL_RGBA8
 
@@ -34,6 +141,7 @@ class Texture:
         for flag, value in {**DEFAULT_PARAMS, **params}.items():
             gl.glTextureParameteri(self.name, flag, value)
         self.clear()
+        registry.add(self, "texture")
 
     def __enter__(self):
         gl.glActiveTexture(gl.GL_TEXTURE0 + self.unit)
@@ -46,11 +154,21 @@ class Texture:
     def clear(self):
         gl.glClearTexImage(self.name, 0, gl.GL_RGBA, gl.GL_FLOAT, None)
 
+    def bind_image(self, unit: int=None, access=gl.GL_READ_WRITE, level: int=0):
+        """
+        Bind the texture to an image unit (by default the same as its texture unit),
+        for image load/store in shaders. The GLSL format must match the texture's.
+        """
+        layered = isinstance(self, Texture3D)
+        gl.glBindImageTexture(self.unit if unit is None else unit, self.name, level, layered, 0,
+                              access, self._type)
+
     def __str__(self):
         return f"Texture(name={self.name.value})"
 
     def delete(self):
-        gl.glDeleteTextures(1, self.name)
+        self._delete_upload_ring()
+        release(self, "texture")
 
     def __del__(self):
         try:
@@ -62,6 +180,8 @@ class Texture:
 class ByteTexture(Texture):
 
     _type = gl.GL_R8UI
+    _format = gl.GL_RED_INTEGER
+    _pixel_size = 1
 
     def clear(self):
         gl.glClearTexImage(self.name, 0, gl.GL_RED_INTEGER, gl.GL_UNSIGNED_BYTE, None)
@@ -70,6 +190,8 @@ class ByteTexture(Texture):
 class BytesTexture(Texture):
 
     _type = gl.GL_RGB8UI
+    _format = gl.GL_RGB_INTEGER
+    _pixel_size = 3
 
     def clear(self):
         gl.glClearTexImage(self.name, 0, gl.GL_RGBA_INTEGER, gl.GL_UNSIGNED_BYTE, None)
@@ -78,11 +200,16 @@ class BytesTexture(Texture):
 class NormalTexture(Texture):
 
     _type = gl.GL_RGBA16F
+    _data_type = gl.GL_FLOAT
+    _pixel_size = 16
 
 
 class DepthTexture(Texture):
 
     _type = gl.GL_DEPTH_COMPONENT16
+    _format = gl.GL_DEPTH_COMPONENT
+    _data_type = gl.GL_UNSIGNED_SHORT
+    _pixel_size = 2
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -110,6 +237,7 @@ class Texture3D(Texture):
         for flag, value in {**DEFAULT_PARAMS, **params}.items():
             gl.glTextureParameteri(self.name, flag, value)
         self.clear()
+        registry.add(self, "texture")
 
     def __enter__(self):
         gl.glActiveTexture(gl.GL_TEXTURE0 + self.unit)
@@ -118,48 +246,79 @@ class Texture3D(Texture):
     def __exit__(self, exc_type, exc_val, exc_tb):
         gl.glBindTexture(gl.GL_TEXTURE_2D_ARRAY, 0)
         gl.glActiveTexture(gl.GL_TEXTURE0)
-        
+
+    def write_layer(self, layer: int, image: bytes):
+        "Upload RGBA image data to one layer of the texture."
+        w, h, _ = self.size
+        gl.glTextureSubImage3D(
+            self.name,
+            0,  # level
+            0, 0, layer,  # offset
+            w, h, 1,
+            gl.GL_RGBA,
+            gl.GL_UNSIGNED_BYTE,
+            (gl.GLubyte * (4 * w * h)).from_buffer_copy(bytes(image))
+        )
+
 
 class ByteTexture3D(Texture3D):
 
     _type = gl.GL_R8UI
+    _format = gl.GL_RED_INTEGER
+    _pixel_size = 1
 
     def clear(self):
         gl.glClearTexImage(self.name, 0, gl.GL_RED_INTEGER, gl.GL_UNSIGNED_BYTE, None)
     
 
-class ImageTexture:
+class ImageTexture(StreamingMixin):
 
     "Texture created from an image."
-    
+
+    _type = gl.GL_RGBA8
+
     def __init__(self, size: Tuple[int, int], image: bytes, unit: int=0,
-                 atlas: Mapping[str, List[float]]=None):
+                 atlas: Mapping[str, List[float]]=None, upload: bool=True):
+        """
+        Without upload, the texture is left empty until upload() is called,
+        e.g. to spread the upload of a large image over several frames.
+        """
         self.size = size
         self.image = image
         self.unit = unit
         self.atlas = atlas
-        self._setup()
+        self._setup(upload)
 
-    def _setup(self):
+    def _setup(self, upload: bool=True):
         self.name = gl.GLuint()
         gl.glCreateTextures(gl.GL_TEXTURE_2D, 1, byref(self.name))
         w, h = self.size
-        gl.glTextureStorage2D(self.name, 1, gl.GL_RGBA8, w, h)
-        gl.glTextureSubImage2D(
-            self.name,
-            0,  # level
-            0, 0,  # offset
-            w, h,
-            gl.GL_RGBA,
-            gl.GL_UNSIGNED_BYTE,
-            (gl.GLchar * (4 * w * h))(*self.image)
-        )
+        gl.glTextureStorage2D(self.name, 1, self._type, w, h)
+        if upload:
+            self.upload()
         gl.glTextureParameteri(self.name,
                                gl.GL_TEXTURE_MAG_FILTER,
                                gl.GL_NEAREST)
         gl.glTextureParameteri(self.name,
                                gl.GL_TEXTURE_MIN_FILTER,
                                gl.GL_NEAREST)
+        registry.add(self, "texture")
+
+    def upload(self, first_row: int=0, rows: int=None):
+        "Upload the image, or the given rows of it (counting from the start of the data)."
+        self.image = bytes(self.image)  # May be an iterator, e.g. from load_png
+        w, h = self.size
+        rows = h - first_row if rows is None else rows
+        start = 4 * w * first_row
+        gl.glTextureSubImage2D(
+            self.name,
+            0,  # level
+            0, first_row,  # offset
+            w, rows,
+            gl.GL_RGBA,
+            gl.GL_UNSIGNED_BYTE,
+            (gl.GLubyte * (4 * w * rows)).from_buffer_copy(self.image, start)
+        )
 
     def get_texture_coords(self, key):
         "Look up the given name in the texture atlas and return its UV coords"
@@ -183,7 +342,8 @@ class ImageTexture:
         gl.glActiveTexture(gl.GL_TEXTURE0)
 
     def delete(self):
-        gl.glDeleteTextures(1, self.name)
+        self._delete_upload_ring()
+        release(self, "texture")
 
     def __del__(self):
         try:
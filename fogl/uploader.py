@@ -0,0 +1,200 @@
+"""
+Uploading buffers and textures from a separate thread, with its own GL context
+shared with the window's. The render thread never spends time on the uploads;
+it only checks, once per frame, the fences telling that they are finished.
+
+    uploader = UploadThread(window)
+    future = uploader.upload_texture(*load_png("big.png"))
+    ...
+    # every frame
+    uploader.poll()
+    if future.done():
+        texture = future.result()
+
+Only objects that contexts share can be made this way, i.e. buffers and
+textures, but not e.g. vertex array objects or framebuffers.
+
+Shut the uploader down before the window closes, e.g. from its on_close, and
+in any case before pyglet.app.run returns.
+"""
+
+from concurrent.futures import Future
+from queue import Queue
+from threading import Lock, Thread
+from time import sleep
+from typing import Callable, List, Tuple
+
+import pyglet
+from pyglet import gl
+
+from .buffer import Buffer
+from .texture import ImageTexture
+from .util import LoggerMixin
+
+
+def _make_current_surfaceless(context) -> bool:
+    """
+    Make a context current on this thread without anything to draw to, which GLX
+    and EGL (with EGL_KHR_surfaceless_context) allow for GL 3.0+ contexts. Returns
+    whether it worked; not possible on other platforms.
+    """
+    if hasattr(context, "egl_context"):
+        from pyglet.libs.egl import egl
+        return bool(egl.eglMakeCurrent(context.display_connection, 0, 0, context.egl_context))
+    if hasattr(context, "glx_context"):
+        from pyglet.gl import glx
+        return bool(glx.glXMakeContextCurrent(context.x_display, 0, 0, context.glx_context))
+    return False
+
+
+def _release_surfaceless(context):
+    if hasattr(context, "egl_context"):
+        from pyglet.libs.egl import egl
+        egl.eglMakeCurrent(context.display_connection, 0, 0, None)
+    elif hasattr(context, "glx_context"):
+        from pyglet.gl import glx
+        glx.glXMakeContextCurrent(context.x_display, 0, 0, None)
+
+
+def _make_current_on_canvas(context):
+    """
+    Make a context current on this thread through the platform (WGL or Cocoa),
+    where it needs a canvas. Unlike Context.set_current, this leaves pyglet's
+    gl.current_context, which is global and belongs to the main thread, alone.
+    """
+    if hasattr(context, "_nscontext"):
+        context._nscontext.makeCurrentContext()
+    else:
+        from pyglet.gl import wgl
+        wgl.wglMakeCurrent(context.canvas.hdc, context._context)
+
+
+def _release_on_canvas(context):
+    if hasattr(context, "_nscontext"):
+        from pyglet.libs.darwin import cocoapy
+        cocoapy.ObjCClass("NSOpenGLContext").clearCurrentContext()
+    else:
+        from pyglet.gl import wgl
+        wgl.wglMakeCurrent(None, None)
+
+
+class UploadThread(LoggerMixin):
+
+    """
+    A thread with a GL context sharing objects with the given window's. Must
+    be created on the thread owning the window (its context stays current).
+    Functions submitted run on the upload thread; each is followed by a fence,
+    and its future is done once poll() finds that the GPU has passed it.
+
+    Where the platform allows, the upload context has no surface. Otherwise it
+    gets a hidden window, which is kept out of pyglet.app's drawing. Either way,
+    the upload thread never touches pyglet's (global) current context.
+    """
+
+    def __init__(self, window: pyglet.window.Window):
+        self.window = window
+        context = window.config.create_context(share=window.context)
+        if _make_current_surfaceless(context):
+            self._canvas = None
+        else:
+            # The context needs something to draw to. The app must not draw the
+            # window, since that would make the context current on this thread.
+            self._canvas = pyglet.window.Window(1, 1, visible=False, context=context)
+            pyglet.app.windows.discard(self._canvas)
+            self._canvas.draw = lambda dt: None
+        window.switch_to()
+        self.context = context
+        self._tasks = Queue()
+        self._lock = Lock()
+        self._fenced: List[Tuple[int, Future, object]] = []
+        self._thread = Thread(target=self._run, name="fogl-uploader", daemon=True)
+        self._thread.start()
+
+    def _make_current(self):
+        if self._canvas is None:
+            _make_current_surfaceless(self.context)
+        else:
+            _make_current_on_canvas(self.context)
+
+    def _run(self):
+        self._make_current()
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            function, args, future = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function(*args)
+            except Exception as e:
+                self.logger.exception("Upload failed")
+                future.set_exception(e)
+                continue
+            fence = gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+            gl.glFlush()  # Makes sure the fence gets to the GPU, or the other context may wait forever
+            with self._lock:
+                self._fenced.append((fence, future, result))
+        gl.glFinish()
+        if self._canvas is None:
+            _release_surfaceless(self.context)
+        else:
+            _release_on_canvas(self.context)
+
+    def submit(self, function: Callable, *args) -> Future:
+        "Run the function with GL on the upload thread. The future's result is what it returns."
+        future = Future()
+        self._tasks.put((function, args, future))
+        return future
+
+    def upload_buffer(self, data, structure=gl.GLfloat) -> Future:
+        "Create a Buffer (see there for the arguments)."
+        return self.submit(Buffer, data, structure)
+
+    def upload_texture(self, size: Tuple[int, int], image: bytes, unit: int=0) -> Future:
+        "Create an ImageTexture."
+        return self.submit(ImageTexture, size, bytes(image), unit)
+
+    def poll(self) -> int:
+        """
+        Complete the futures of uploads that the GPU is done with, without waiting.
+        Call from the render thread, e.g. once per frame. Returns the number completed.
+        """
+        with self._lock:
+            fenced = self._fenced
+            self._fenced = []
+        pending = []
+        for fence, future, result in fenced:
+            if gl.glClientWaitSync(fence, 0, 0) in (gl.GL_ALREADY_SIGNALED, gl.GL_CONDITION_SATISFIED):
+                gl.glDeleteSync(fence)
+                future.set_result(result)
+            else:
+                pending.append((fence, future, result))
+        with self._lock:
+            self._fenced[:0] = pending
+        return len(fenced) - len(pending)
+
+    def wait(self, future: Future):
+        "Block until the upload is done and usable on the render thread; returns the result."
+        while not future.done():
+            with self._lock:
+                fence = next((fence for fence, f, _ in self._fenced if f is future), None)
+            if fence is None:
+                sleep(0.001)  # Still on the upload thread
+            else:
+                gl.glClientWaitSync(fence, 0, 1_000_000_000)
+                self.poll()
+        return future.result()
+
+    def shutdown(self):
+        "Stop the thread, after finishing what's queued, and drop its context."
+        self._tasks.put(None)
+        self._thread.join()
+        while self._fenced:
+            self.poll()
+        if self._canvas is None:
+            self.context.destroy()
+        else:
+            pyglet.app.windows.add(self._canvas)  # Window.close() removes it from there
+            self._canvas.close()
+        self.window.switch_to()
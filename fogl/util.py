@@ -106,3 +106,14 @@ def load_png(filename):
         reader = png.Reader(bytes=f.read())
         width, height, rows, info = reader.asRGBA()
         return (width, height), chain.from_iterable(rows)
+
+
+def write_png(filename, size, data):
+    """
+    Write RGBA data, as read from GL (i.e. bottom row first), to a png file.
+    """
+    w, h = size
+    stride = 4 * w
+    rows = [data[stride * y:stride * (y + 1)] for y in reversed(range(h))]
+    with open(filename, "wb") as f:
+        png.Writer(w, h, greyscale=False, alpha=True).write(f, rows)
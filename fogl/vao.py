@@ -1,8 +1,9 @@
 from ctypes import byref
-from ctypes import c_uint
 
 from pyglet import gl
 
+from .deletion import release
+from .resources import registry
 from .vertex import Vertices
 
 
@@ -17,6 +18,7 @@ class VertexArrayObject:
         self.name = gl.GLuint()
         self.vertices_class = vertices_class
         gl.glCreateVertexArrays(1, byref(self.name))
+        registry.add(self, "vertex_array")
 
     def __enter__(self):
         gl.glBindVertexArray(self.name)
@@ -24,12 +26,12 @@ class VertexArrayObject:
     def __exit__(self, exc_type, exc_val, exc_tb):
         gl.glBindVertexArray(0)
 
-    def create_vertices(self, data):
+    def create_vertices(self, data, indices=None, **kwargs):
         "Just a convenience."
-        return self.vertices_class(self, data)
+        return self.vertices_class(self, data, indices, **kwargs)
 
     def delete(self):
-        gl.glDeleteVertexArrays(1, (c_uint*1)(self.name))
+        release(self, "vertex_array")
     
     def __del__(self):
         try:
@@ -5,9 +5,14 @@ Handling of GL vertex (attribute) data, such as 3D models.
 
 from abc import ABCMeta
 from ctypes import Structure, sizeof
+from math import sqrt
 from typing import List, Tuple
 
 from ctypes import Structure, sizeof, c_uint
+try:
+    import numpy as np
+except ImportError:
+    np = None
 from pyglet import gl
 
 from .buffer import Buffer, IndexBuffer
@@ -35,6 +40,25 @@ def build_structure(fields):
     return _structure
 
 
+def compute_bounds(positions):
+    """
+    Return the axis aligned bounding box (lo, hi) of the given points, and a bounding
+    sphere (center, radius) around the center of the box. Positions may be a numpy
+    array of shape (n, 3), which is a lot faster for big meshes.
+    """
+    if np and isinstance(positions, np.ndarray):
+        lo, hi = positions.min(axis=0), positions.max(axis=0)
+        center = (lo + hi) / 2
+        radius = np.sqrt(((positions - center)**2).sum(axis=1).max())
+        return (tuple(lo.tolist()), tuple(hi.tolist())), (tuple(center.tolist()), float(radius))
+    xs, ys, zs = zip(*positions)
+    lo = min(xs), min(ys), min(zs)
+    hi = max(xs), max(ys), max(zs)
+    cx, cy, cz = center = tuple((a + b) / 2 for a, b in zip(lo, hi))
+    radius = sqrt(max((x - cx)**2 + (y - cy)**2 + (z - cz)**2 for x, y, z in positions))
+    return (lo, hi), (center, radius)
+
+
 class Vertices(LoggerMixin, metaclass=ABCMeta):
 
     _fields = [
@@ -42,7 +66,12 @@ class Vertices(LoggerMixin, metaclass=ABCMeta):
         # Should be a list of tuples (name, gltype, n_elements)
     ]
 
-    def __init__(self, vao, data: List[Tuple[Tuple]], indices=None):
+    def __init__(self, vao, data: List[Tuple[Tuple]], indices=None, primitive_restart: bool=False,
+                 vertex_buffer: Buffer=None):
+        """
+        Instead of data, an existing vertex_buffer with the right structure may be
+        given, e.g. one written by transform feedback.
+        """
         self.vao = vao
         self.data = data
 
@@ -50,11 +79,15 @@ class Vertices(LoggerMixin, metaclass=ABCMeta):
         self.size = sizeof(self._structure)
 
         with vao:
-            self.vertex_buffer = Buffer(data, self._structure)
-            if indices:
-                self.index_buffer = IndexBuffer(indices)
+            if vertex_buffer is None:
+                self.vertex_buffer = Buffer(data, self._structure)
             else:
-                self.index_buffer = IndexBuffer(range(len(self.data)))
+                self.vertex_buffer = vertex_buffer
+            n_vertices = len(data) if data is not None else vertex_buffer.size // self.size
+            if indices is not None:
+                self.index_buffer = IndexBuffer(indices, primitive_restart=primitive_restart)
+            else:
+                self.index_buffer = IndexBuffer(range(n_vertices))
 
         offset = 0
         for i, (name, type_, n_elements) in enumerate(self._fields):
@@ -83,20 +116,36 @@ class Vertices(LoggerMixin, metaclass=ABCMeta):
             offset += sizeof(gltypes[type_]) * n_elements
             gl.glEnableVertexArrayAttrib(vao.name, i)  # enable the attribute
 
-        self.length = len(data)
+        self.length = len(indices) if indices is not None else n_vertices
         self.logger.debug("Length: %d, size: %d", self.length, self.size)
 
+        # Bounding volumes, e.g. for culling. Requires a "position" field.
+        field_names = [name for name, _, _ in self._fields]
+        if data is not None and len(data) and "position" in field_names:
+            if np and isinstance(data, np.ndarray):
+                vertices = np.ascontiguousarray(data).reshape(-1).view(np.dtype(self._structure))
+                positions = vertices["position"][:, :3].astype(np.float64)
+            else:
+                i = field_names.index("position")
+                positions = [vertex[i][:3] for vertex in data]
+            self.bounds, self.bounding_sphere = compute_bounds(positions)
+        else:
+            self.bounds = self.bounding_sphere = None
+
     @property
     def indexed(self):
         return bool(self.index_buffer)
 
     def draw(self, mode=gl.GL_TRIANGLES, indices=None):
-        if indices:
-            with indices:
-                gl.glDrawElements(mode, len(indices), gl.GL_UNSIGNED_INT, 0)
-        else:
-            with self.index_buffer:
-                gl.glDrawElements(mode, self.length, gl.GL_UNSIGNED_INT, 0)
+        if indices is None:
+            indices = self.index_buffer
+        with indices:
+            if indices.primitive_restart:
+                gl.glEnable(gl.GL_PRIMITIVE_RESTART_FIXED_INDEX)
+                gl.glDrawElements(mode, len(indices), indices.gl_type, 0)
+                gl.glDisable(gl.GL_PRIMITIVE_RESTART_FIXED_INDEX)
+            else:
+                gl.glDrawElements(mode, len(indices), indices.gl_type, 0)
 
     def delete(self):
         self.vertex_buffer.delete()